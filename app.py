@@ -1,85 +1,1195 @@
 import streamlit as st
 import pandas as pd
 import sqlite3
+import os
+import time
+import logging
+import collections
+import functools
+import queue
+import threading
+import contextlib
+import tempfile
+import gzip
+import re
 import datetime
+import importlib.util
 import numpy as np
 
 # --- 1. 数据库配置与初始化 ---
 DB_FILE = 'warehouse.db'
+logger = logging.getLogger("warehouse")
+
+
+# 写锁等待超时 (秒) 与整笔写事务的重试次数
+DB_BUSY_TIMEOUT = 5
+DB_WRITE_RETRIES = 4
+
+
+# 连接调优参数: WAL 允许读写并发, NORMAL 同步在 WAL 下足够安全, 加大页缓存与内存映射
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA temp_store=MEMORY",
+)
+
+
+def sql_fingerprint(sql):
+    # 归一化 SQL: 去掉字面量与多余空白, IN 列表折叠, 便于按语句聚合统计
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = re.sub(r"\b\d+(?:\.\d+)?\b", "?", sql)
+    sql = re.sub(r"\(\s*\?(?:\s*,\s*\?)*\s*\)", "(...)", sql)
+    return re.sub(r"\s+", " ", sql).strip()
+
+
+class QueryProfiler:
+    # 可选的查询性能分析: 记录每条语句的耗时 / 行数 / DataFrame 构建耗时,
+    # 慢查询附带 EXPLAIN QUERY PLAN 写入日志; 按语句指纹滚动聚合, 定期写入 query_metrics 表
+    def __init__(self, enabled=False, slow_ms=200.0, flush_interval=30.0):
+        self.enabled = enabled
+        self.slow_ms = slow_ms
+        self.flush_interval = flush_interval
+        self.slow_queries = collections.deque(maxlen=50)
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._last_flush = time.monotonic()
+
+    def start_rerun(self):
+        self._local.records = []
+
+    def rerun_records(self):
+        return getattr(self._local, 'records', [])
+
+    @contextlib.contextmanager
+    def paused(self):
+        # 分析器自身的查询 (执行计划 / 写入指标) 不计入统计
+        self._local.paused = True
+        try:
+            yield
+        finally:
+            self._local.paused = False
+
+    def record(self, conn, sql, seconds, rows=None, df_seconds=0.0):
+        if not self.enabled or getattr(self._local, 'paused', False):
+            return
+        fingerprint = sql_fingerprint(sql)
+        ms, df_ms = seconds * 1000, df_seconds * 1000
+        rows = rows if rows is not None and rows >= 0 else None
+        self.rerun_records().append({'sql': fingerprint, 'ms': ms, 'rows': rows, 'df_ms': df_ms})
+        with self._lock:
+            stat = self._stats.setdefault(fingerprint, {'calls': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'rows': 0})
+            stat['calls'] += 1
+            stat['total_ms'] += ms + df_ms
+            stat['max_ms'] = max(stat['max_ms'], ms + df_ms)
+            stat['rows'] += rows or 0
+        if ms + df_ms >= self.slow_ms:
+            plan = []
+            if re.match(r"\s*(SELECT|WITH|UPDATE|DELETE|INSERT)", sql, re.IGNORECASE):
+                try:
+                    with self.paused():
+                        plan = [r[-1] for r in conn.execute("EXPLAIN QUERY PLAN " + sql, (None,) * sql.count('?'))]
+                except sqlite3.Error:
+                    pass
+            self.slow_queries.appendleft({'time': datetime.datetime.now(), 'sql': fingerprint, 'ms': ms + df_ms,
+                                          'plan': " / ".join(plan)})
+            logger.warning("slow query %.1f ms: %s | plan: %s", ms + df_ms, fingerprint, " / ".join(plan) or "-")
+
+    def aggregate(self):
+        with self._lock:
+            return {fp: dict(stat) for fp, stat in self._stats.items()}
+
+    def flush(self, conn, force=False):
+        # 将内存中的增量聚合累加到 query_metrics 表
+        if not force and time.monotonic() - self._last_flush < self.flush_interval:
+            return
+        with self._lock:
+            stats, self._stats = self._stats, {}
+            self._last_flush = time.monotonic()
+        if not stats:
+            return
+        now = datetime.datetime.now()
+        with self.paused():
+            with conn:
+                conn.executemany(
+                    """INSERT INTO query_metrics (fingerprint, calls, total_ms, max_ms, total_rows, last_seen)
+                       VALUES (?,?,?,?,?,?)
+                       ON CONFLICT (fingerprint) DO UPDATE SET calls = calls + excluded.calls,
+                           total_ms = total_ms + excluded.total_ms, max_ms = MAX(max_ms, excluded.max_ms),
+                           total_rows = total_rows + excluded.total_rows, last_seen = excluded.last_seen""",
+                    [(fp, s['calls'], s['total_ms'], s['max_ms'], s['rows'], now) for fp, s in stats.items()])
+
+
+@st.cache_resource
+def get_query_profiler():
+    return QueryProfiler(enabled=os.environ.get('WAREHOUSE_PROFILE') == '1')
+
+
+class ProfiledConnection(sqlite3.Connection):
+    # 连接上直接执行的语句 (事务写入路径) 在启用分析时计时
+    profiler = None
+
+    def execute(self, sql, params=()):
+        if self.profiler is None or not self.profiler.enabled:
+            return super().execute(sql, params)
+        start = time.perf_counter()
+        cur = super().execute(sql, params)
+        self.profiler.record(self, sql, time.perf_counter() - start, cur.rowcount)
+        return cur
+
+    def executemany(self, sql, seq_of_params):
+        if self.profiler is None or not self.profiler.enabled:
+            return super().executemany(sql, seq_of_params)
+        start = time.perf_counter()
+        cur = super().executemany(sql, seq_of_params)
+        self.profiler.record(self, sql, time.perf_counter() - start, cur.rowcount)
+        return cur
+
+
+class ConnectionPool:
+    # 进程内共享的连接池: Streamlit 每次重跑都在新线程中执行, 线程局部连接无法跨重跑复用,
+    # 因此按需借出/归还长连接, 保留页缓存与已编译语句
+    def __init__(self, db_file, profiler=None, max_idle=8):
+        self.db_file = db_file
+        self.profiler = profiler
+        self.max_idle = max_idle
+        self._idle = queue.LifoQueue()
+
+    def _connect(self):
+        # cached_statements: 同一连接上复用已编译的语句
+        conn = sqlite3.connect(self.db_file, timeout=DB_BUSY_TIMEOUT, cached_statements=256, check_same_thread=False,
+                               factory=ProfiledConnection)
+        conn.profiler = self.profiler
+        for pragma in SQLITE_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    @contextlib.contextmanager
+    def connection(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            if self._idle.qsize() < self.max_idle:
+                self._idle.put(conn)
+            else:
+                conn.close()
+
+
+@st.cache_resource
+def get_connection_pool():
+    return ConnectionPool(DB_FILE, get_query_profiler())
+
+
+def db_connection():
+    return get_connection_pool().connection()
+
+
+# logs 表结构 (归档表沿用同一结构)
+LOGS_TABLE_DDL = '''(id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     applicant TEXT,
+                     action_type TEXT,
+                     name TEXT,
+                     model TEXT,
+                     spec TEXT,
+                     color TEXT,
+                     unit TEXT,
+                     quantity INTEGER,
+                     location TEXT,
+                     remark TEXT,
+                     status TEXT,
+                     timestamp DATETIME,
+                     approved_at DATETIME)'''
+
+
+# 日志计数的统计维度: (scope, key 表达式); 'all' 为全局合计, 待审核角标只需读取其中一行
+LOG_COUNTER_SCOPES = (
+    ("'all'", "''"),
+    ("'applicant'", "COALESCE({row}.applicant, '')"),
+    ("'type'", "COALESCE({row}.action_type, '')"),
+)
+
+
+# 每日出入库汇总的统计维度: (scope, key 表达式); 物品维度的 key 为物品键各字段以 \x1f 拼接
+STOCK_DAILY_SCOPES = (
+    ("'item'", "COALESCE({row}.name, '') || char(31) || COALESCE({row}.model, '') || char(31) || "
+               "COALESCE({row}.spec, '') || char(31) || COALESCE({row}.color, '') || char(31) || "
+               "COALESCE({row}.location, '')"),
+    ("'location'", "COALESCE({row}.location, '')"),
+    ("'applicant'", "COALESCE({row}.applicant, '')"),
+)
+# 计入出入库汇总的日志: 已通过的入库/领用
+STOCK_MOVE_COND = "{row}.status = 'APPROVED' AND {row}.action_type IN ('IN', 'OUT')"
+
+
+def _log_counter_sql(row, delta):
+    return " ".join(
+        f"""INSERT INTO log_counters (scope, key, status, cnt)
+            VALUES ({scope}, {key.format(row=row)}, COALESCE({row}.status, ''), {delta})
+            ON CONFLICT (scope, key, status) DO UPDATE SET cnt = cnt + excluded.cnt;"""
+        for scope, key in LOG_COUNTER_SCOPES)
+
+
+def _stock_daily_select(row):
+    # 按 (scope, key, 日期) 汇总的入库量 / 领用量 / 笔数
+    return [f"""SELECT {scope}, {key.format(row=row)}, date({row}.timestamp),
+                       SUM(CASE WHEN {row}.action_type = 'IN' THEN {row}.quantity ELSE 0 END),
+                       SUM(CASE WHEN {row}.action_type = 'OUT' THEN {row}.quantity ELSE 0 END), COUNT(*)"""
+            for scope, key in STOCK_DAILY_SCOPES]
+
+
+def _stock_daily_sql(row):
+    return " ".join(
+        f"""INSERT INTO stock_daily (scope, key, day, in_qty, out_qty, moves) {select} WHERE true
+            ON CONFLICT (scope, day, key) DO UPDATE SET in_qty = in_qty + excluded.in_qty,
+                out_qty = out_qty + excluded.out_qty, moves = moves + excluded.moves;"""
+        for select in _stock_daily_select(row))
 
 
 def init_db():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS inventory
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  name TEXT NOT NULL,
-                  model TEXT,
-                  spec TEXT,
-                  color TEXT,
-                  unit TEXT,
-                  quantity INTEGER,
-                  location TEXT,
-                  remark TEXT)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS logs
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  applicant TEXT,
-                  action_type TEXT,
-                  name TEXT,
-                  model TEXT,
-                  spec TEXT,
-                  color TEXT,
-                  unit TEXT,
-                  quantity INTEGER,
-                  location TEXT,
-                  remark TEXT,
-                  status TEXT,
-                  timestamp DATETIME)''')
-    conn.commit()
-    conn.close()
+    with db_connection() as conn:
+        c = conn.cursor()
+        c.execute('''CREATE TABLE IF NOT EXISTS inventory
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      name TEXT NOT NULL,
+                      model TEXT,
+                      spec TEXT,
+                      color TEXT,
+                      unit TEXT,
+                      quantity INTEGER,
+                      location TEXT,
+                      remark TEXT,
+                      version INTEGER NOT NULL DEFAULT 0)''')
+        # 旧库迁移: 乐观并发控制用的行版本号
+        if 'version' not in [r[1] for r in c.execute("PRAGMA table_info(inventory)")]:
+            c.execute("ALTER TABLE inventory ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        c.execute(f"CREATE TABLE IF NOT EXISTS logs {LOGS_TABLE_DDL}")
+        # 旧库迁移: 审批时间 (归档表与 logs 结构保持一致, 一并补列); 迁移前的日志按提交时间计
+        for table in [r[0] for r in c.execute(
+                "SELECT name FROM sqlite_master WHERE type='table' AND (name='logs' OR name LIKE 'logs_archive_%')")]:
+            if 'approved_at' not in [r[1] for r in c.execute(f"PRAGMA table_info({table})")]:
+                c.execute(f"ALTER TABLE {table} ADD COLUMN approved_at DATETIME")
+        has_item_key = c.execute("SELECT 1 FROM sqlite_master WHERE type='index' AND name='ux_inventory_item'").fetchone()
+        if not has_item_key:
+            # 建唯一索引前先合并历史重复行 (数量累加到最小 id 的那一行)
+            c.execute('''UPDATE inventory SET quantity =
+                             (SELECT SUM(i2.quantity) FROM inventory i2
+                              WHERE i2.name IS inventory.name AND i2.model IS inventory.model AND i2.spec IS inventory.spec
+                                AND i2.color IS inventory.color AND i2.location IS inventory.location)
+                         WHERE id IN (SELECT MIN(id) FROM inventory GROUP BY name, model, spec, color, location
+                                      HAVING COUNT(*) > 1)''')
+            c.execute('''DELETE FROM inventory WHERE id NOT IN
+                             (SELECT MIN(id) FROM inventory GROUP BY name, model, spec, color, location)''')
+            c.execute("CREATE UNIQUE INDEX ux_inventory_item ON inventory (name, model, spec, color, location)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_logs_status ON logs (status)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_logs_applicant ON logs (applicant, id)")
+        c.execute('''CREATE TABLE IF NOT EXISTS query_metrics
+                     (fingerprint TEXT PRIMARY KEY,
+                      calls INTEGER,
+                      total_ms REAL,
+                      max_ms REAL,
+                      total_rows INTEGER,
+                      last_seen DATETIME)''')
+        has_fts = c.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='inventory_fts'").fetchone()
+        if not has_fts:
+            # 库存全文索引 (trigram 分词, 支持中文子串匹配), 以 inventory 为外部内容表, 由触发器同步
+            try:
+                c.execute('''CREATE VIRTUAL TABLE inventory_fts USING fts5
+                             (name, model, spec, color, location,
+                              content='inventory', content_rowid='id', tokenize='trigram')''')
+            except sqlite3.OperationalError:
+                logger.warning("SQLite 未启用 FTS5, 库存搜索退化为 LIKE 查询")
+            else:
+                c.execute("INSERT INTO inventory_fts (inventory_fts) VALUES ('rebuild')")
+                c.execute('''CREATE TRIGGER trg_inventory_fts_insert AFTER INSERT ON inventory BEGIN
+                                 INSERT INTO inventory_fts (rowid, name, model, spec, color, location)
+                                 VALUES (NEW.id, NEW.name, NEW.model, NEW.spec, NEW.color, NEW.location);
+                             END''')
+                c.execute('''CREATE TRIGGER trg_inventory_fts_delete AFTER DELETE ON inventory BEGIN
+                                 INSERT INTO inventory_fts (inventory_fts, rowid, name, model, spec, color, location)
+                                 VALUES ('delete', OLD.id, OLD.name, OLD.model, OLD.spec, OLD.color, OLD.location);
+                             END''')
+                # 只有检索字段变化才更新索引, 数量变动不触发
+                c.execute('''CREATE TRIGGER trg_inventory_fts_update
+                             AFTER UPDATE OF name, model, spec, color, location ON inventory BEGIN
+                                 INSERT INTO inventory_fts (inventory_fts, rowid, name, model, spec, color, location)
+                                 VALUES ('delete', OLD.id, OLD.name, OLD.model, OLD.spec, OLD.color, OLD.location);
+                                 INSERT INTO inventory_fts (rowid, name, model, spec, color, location)
+                                 VALUES (NEW.id, NEW.name, NEW.model, NEW.spec, NEW.color, NEW.location);
+                             END''')
+        has_counters = c.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='log_counters'").fetchone()
+        if not has_counters:
+            # 日志计数汇总表: 由触发器随 logs 的增删与状态变更维护, 首次建表时从现有日志回填
+            c.execute('''CREATE TABLE log_counters
+                         (scope TEXT NOT NULL,
+                          key TEXT NOT NULL,
+                          status TEXT NOT NULL,
+                          cnt INTEGER NOT NULL,
+                          PRIMARY KEY (scope, key, status))''')
+            for scope, key in LOG_COUNTER_SCOPES:
+                c.execute(f"""INSERT INTO log_counters (scope, key, status, cnt)
+                              SELECT {scope}, {key.format(row='logs')}, COALESCE(status, ''), COUNT(*) FROM logs
+                              GROUP BY 2, 3""")
+        c.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_logs_count_insert AFTER INSERT ON logs
+                      BEGIN {_log_counter_sql('NEW', 1)} END""")
+        c.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_logs_count_delete AFTER DELETE ON logs
+                      BEGIN {_log_counter_sql('OLD', -1)} END""")
+        c.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_logs_count_status AFTER UPDATE OF status ON logs
+                      WHEN OLD.status IS NOT NEW.status
+                      BEGIN {_log_counter_sql('OLD', -1)} {_log_counter_sql('NEW', 1)} END""")
+        has_daily = c.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='stock_daily'").fetchone()
+        if not has_daily:
+            # 每日出入库汇总表: 记录实际发生的库存变动, 不随日志清空/归档扣减; 首次建表时从现有日志与归档回填
+            c.execute('''CREATE TABLE stock_daily
+                         (scope TEXT NOT NULL,
+                          key TEXT NOT NULL,
+                          day TEXT NOT NULL,
+                          in_qty INTEGER NOT NULL,
+                          out_qty INTEGER NOT NULL,
+                          moves INTEGER NOT NULL,
+                          PRIMARY KEY (scope, day, key))''')
+            archives = [r[0] for r in c.execute(
+                "SELECT name FROM sqlite_master WHERE type='table' AND name LIKE 'logs_archive_%'")]
+            source = " UNION ALL ".join(f"SELECT * FROM {t}" for t in ['logs'] + archives)
+            for select in _stock_daily_select('l'):
+                c.execute(f"""INSERT INTO stock_daily (scope, key, day, in_qty, out_qty, moves)
+                              {select} FROM ({source}) l WHERE {STOCK_MOVE_COND.format(row='l')} GROUP BY 2, 3""")
+        # 库存检查点: 定期保存的完整库存副本, 历史库存从最近的检查点起重放之后的日志得到
+        c.execute('''CREATE TABLE IF NOT EXISTS stock_checkpoints
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      taken_at DATETIME NOT NULL,
+                      last_log_id INTEGER NOT NULL,
+                      replay_from DATETIME NOT NULL,
+                      items INTEGER NOT NULL)''')
+        c.execute('''CREATE TABLE IF NOT EXISTS stock_checkpoint_items
+                     (checkpoint_id INTEGER NOT NULL,
+                      name TEXT, model TEXT, spec TEXT, color TEXT, location TEXT, unit TEXT, quantity INTEGER)''')
+        # 检查点时仍待审核的申请, 之后获批时也要重放
+        c.execute('''CREATE TABLE IF NOT EXISTS stock_checkpoint_pending
+                     (checkpoint_id INTEGER NOT NULL,
+                      log_id INTEGER NOT NULL,
+                      PRIMARY KEY (checkpoint_id, log_id))''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_checkpoint_items ON stock_checkpoint_items (checkpoint_id)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_checkpoints_taken_at ON stock_checkpoints (taken_at)")
+        # 审批通过时按申请提交日期计入 (与回填口径一致)
+        c.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_logs_daily_insert AFTER INSERT ON logs
+                      WHEN {STOCK_MOVE_COND.format(row='NEW')}
+                      BEGIN {_stock_daily_sql('NEW')} END""")
+        c.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_logs_daily_approve AFTER UPDATE OF status ON logs
+                      WHEN OLD.status IS NOT 'APPROVED' AND {STOCK_MOVE_COND.format(row='NEW')}
+                      BEGIN {_stock_daily_sql('NEW')} END""")
+        conn.commit()
 
 
 # --- 2. 核心功能函数 ---
-def run_query(query, params=()):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute(query, params)
-    if query.strip().upper().startswith("SELECT"):
+def retry_on_busy(fn):
+    # 写事务遇到 "database is locked" 时整笔回滚后指数退避重试
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        for attempt in range(DB_WRITE_RETRIES):
+            try:
+                return fn(*args, **kwargs)
+            except sqlite3.OperationalError as e:
+                if attempt == DB_WRITE_RETRIES - 1 or not ('locked' in str(e) or 'busy' in str(e)):
+                    raise
+                logger.warning("database busy, retrying %s (%d)", fn.__name__, attempt + 1)
+                time.sleep(0.05 * 2 ** attempt)
+    return wrapper
+
+
+class Record:
+    # 轻量行对象 (__slots__), 支持 row.name 与 row['name'] 两种取值方式
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return f"Record({self.as_dict()})"
+
+
+@functools.lru_cache(maxsize=128)
+def _record_type(columns):
+    return type('Record', (Record,), {'__slots__': columns})
+
+
+def _fetch(query, params, many, records):
+    with db_connection() as conn:
+        c = conn.cursor()
+        start = time.perf_counter()
+        c.execute(query, params)
+        rows = c.fetchall() if many else c.fetchone()
+        if records and rows:
+            cls = _record_type(tuple(d[0] for d in c.description))
+            rows = [cls(*r) for r in rows] if many else cls(*rows)
+        conn.profiler.record(conn, query, time.perf_counter() - start, len(rows) if many else int(rows is not None))
+        return rows
+
+
+def fetch_all(query, params=(), records=False):
+    # 返回元组列表 (records=True 时返回 Record 列表), 不构建 DataFrame
+    return _fetch(query, params, True, records)
+
+
+def fetch_one(query, params=(), records=False):
+    # 返回第一行 (元组或 Record), 无结果时返回 None
+    return _fetch(query, params, False, records)
+
+
+def fetch_scalar(query, params=(), default=None):
+    row = _fetch(query, params, False, False)
+    return row[0] if row is not None and row[0] is not None else default
+
+
+def fetch_df(query, params=()):
+    # 仅用于需要展示或向量化处理的查询
+    with db_connection() as conn:
+        c = conn.cursor()
+        start = time.perf_counter()
+        c.execute(query, params)
         data = c.fetchall()
+        fetched = time.perf_counter()
         cols = [description[0] for description in c.description]
-        conn.close()
-        return pd.DataFrame(data, columns=cols)
-    else:
+        df = pd.DataFrame(data, columns=cols)
+        conn.profiler.record(conn, query, fetched - start, len(data), time.perf_counter() - fetched)
+        return df
+
+
+@retry_on_busy
+def run_query(query, params=()):
+    if query.strip().upper().startswith("SELECT"):
+        return fetch_df(query, params)
+    with db_connection() as conn:
+        c = conn.cursor()
+        start = time.perf_counter()
+        c.execute(query, params)
         conn.commit()
-        conn.close()
+        conn.profiler.record(conn, query, time.perf_counter() - start, c.rowcount)
+
+
+@contextlib.contextmanager
+def db_transaction(immediate=False):
+    # 事务内的所有语句要么全部提交, 要么全部回滚; immediate=True 时开始即获取写锁 (BEGIN IMMEDIATE),
+    # 保证事务内先读后写的数据在提交前不会被其他会话修改
+    with db_connection() as conn:
+        with conn:
+            if immediate:
+                conn.execute("BEGIN IMMEDIATE")
+            yield conn
+
+
+class DataVersions:
+    # 进程内数据版本号: 写库存后递增, 读缓存以版本号为键, 写入后缓存即时失效
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = {}
+
+    def get(self, table):
+        return self._versions.get(table, 0)
+
+    def bump(self, table):
+        with self._lock:
+            self._versions[table] = self._versions.get(table, 0) + 1
+
+
+@st.cache_resource
+def get_data_versions():
+    return DataVersions()
+
+
+@contextlib.contextmanager
+def inventory_transaction():
+    # 修改库存的事务 (BEGIN IMMEDIATE): 提交成功后递增库存版本号
+    with db_transaction(immediate=True) as conn:
+        yield conn
+    get_data_versions().bump('inventory')
+
+
+@st.cache_data(max_entries=4)
+def load_inventory_snapshot(version):
+    # 库存快照 (按版本号缓存)
+    return fetch_df("SELECT * FROM inventory ORDER BY location")
+
+
+INVENTORY_SEARCH_COLS = ['name', 'model', 'spec', 'color', 'location']
+
+
+def search_inventory(text, limit=20):
+    # 服务端库存检索, 只返回排名前 limit 条 (Record 列表).
+    # 3 个字符及以上的词走 FTS5 trigram 索引 (子串/前缀匹配, bm25 排序); 更短的词 (如两个汉字) 用 LIKE 补充过滤
+    terms = text.strip().lower().split()
+    if not terms:
+        return []
+    like = "(" + " OR ".join(f"i.{col} LIKE ?" for col in INVENTORY_SEARCH_COLS) + ")"
+    has_fts = fetch_scalar("SELECT 1 FROM sqlite_master WHERE type='table' AND name='inventory_fts'", default=0)
+    fts_terms = [t for t in terms if len(t) >= 3] if has_fts else []
+    like_terms = [t for t in terms if t not in fts_terms]
+    clauses = [like] * len(like_terms)
+    params = [f"%{t}%" for t in like_terms for _ in INVENTORY_SEARCH_COLS]
+    if fts_terms:
+        match = " AND ".join('"' + t.replace('"', '""') + '"' for t in fts_terms)
+        sql = ("SELECT i.* FROM inventory_fts JOIN inventory i ON i.id = inventory_fts.rowid WHERE inventory_fts MATCH ?"
+               + "".join(" AND " + c for c in clauses) + " ORDER BY bm25(inventory_fts) LIMIT ?")
+        params = [match] + params + [limit]
+    else:
+        sql = ("SELECT i.* FROM inventory i WHERE " + " AND ".join(clauses)
+               + " ORDER BY i.name LIKE ? DESC, i.name LIMIT ?")
+        params = params + [f"{terms[0]}%", limit]
+    return fetch_all(sql, params, records=True)
+
+
+def get_inventory_snapshot():
+    return load_inventory_snapshot(get_data_versions().get('inventory'))
+
+
+LOG_INSERT_SQL = """INSERT INTO logs
+                    (applicant, action_type, name, model, spec, color, unit, quantity, location, remark, status, timestamp)
+                    VALUES (?,?,?,?,?,?,?,?,?,?,?,?)"""
+
+
+def stock_in(conn, name, model, spec, color, unit, quantity, location, remark):
+    # 按物品唯一键 (名称, 型号, 规格, 颜色, 位置) 原子地新增或累加, 返回入库后的数量
+    row = conn.execute(
+        """INSERT INTO inventory (name, model, spec, color, unit, quantity, location, remark) VALUES (?,?,?,?,?,?,?,?)
+           ON CONFLICT (name, model, spec, color, location)
+           DO UPDATE SET quantity = quantity + excluded.quantity, remark = excluded.remark, version = version + 1
+           RETURNING quantity""",
+        (name, model, spec, color, unit, quantity, location, remark)).fetchone()
+    return row[0]
+
+
+def stock_out(conn, name, model, spec, color, quantity, location):
+    # 带库存校验的扣减: 库存不足时不做任何修改并返回 None, 扣减到 0 时删除该行
+    row = conn.execute(
+        """UPDATE inventory SET quantity = quantity - ?, version = version + 1
+           WHERE name=? AND model=? AND spec=? AND color=? AND location=? AND quantity >= ?
+           RETURNING id, quantity""",
+        (quantity, name, model, spec, color, location, quantity)).fetchone()
+    if row is None:
+        return None
+    if row[1] == 0:
+        conn.execute("DELETE FROM inventory WHERE id=?", (row[0],))
+    return row[1]
+
+
+@retry_on_busy
+def admin_stock_move(act_code, applicant, name, model, spec, color, unit, quantity, location, remark):
+    # 管理员直接入库/领用: 库存与日志在同一事务内提交; 返回变动后的数量, 库存不足时返回 None
+    with inventory_transaction() as conn:
+        if act_code == 'IN':
+            new_qty = stock_in(conn, name, model, spec, color, unit, quantity, location, remark)
+        else:
+            new_qty = stock_out(conn, name, model, spec, color, quantity, location)
+        if new_qty is not None:
+            conn.execute(LOG_INSERT_SQL, (applicant, act_code, name, model, spec, color, unit, quantity, location,
+                                          remark, 'APPROVED', datetime.datetime.now()))
+    return new_qty
+
+
+INVENTORY_FIELDS = ['name', 'model', 'spec', 'color', 'unit', 'quantity', 'location', 'remark']
+
+
+def _db_value(v):
+    # data_editor 返回的 numpy 标量 / NaN 转为 sqlite 可直接绑定的 Python 值
+    if v is None or (isinstance(v, float) and np.isnan(v)) or v is pd.NA:
+        return None
+    if isinstance(v, np.generic):
+        return v.item()
+    return v
+
+
+@retry_on_busy
+def save_inventory_edits(original_df, delta, applicant='admin'):
+    # 根据 data_editor 的编辑增量 (edited_rows / added_rows / deleted_rows) 只写入变动的行,
+    # 库存修改与对应的 ADMIN_* 日志在同一事务中提交.
+    # 修改/删除按行版本号做乐观并发校验: 编辑期间已被他人改动的行不会被覆盖, 与违反约束的行一起作为冲突返回
+    now = datetime.datetime.now()
+    log_rows, conflicts = [], []
+
+    def conflict(row, reason):
+        conflicts.append({'序号': _db_value(row.get('id')), '名称': row.get('name'), '位置': row.get('location'),
+                          '原因': reason})
+
+    with inventory_transaction() as conn:
+        for pos in delta.get('deleted_rows', []):
+            row = original_df.iloc[int(pos)]
+            if not conn.execute("DELETE FROM inventory WHERE id=? AND version=?",
+                                (int(row['id']), int(row['version']))).rowcount:
+                conflict(row, "已被其他人修改或删除")
+                continue
+            msg = f"删除了物品: {row['name']} (位置: {row['location']}, 数量: {row['quantity']})"
+            log_rows.append((applicant, 'ADMIN_DEL', *[_db_value(row[k]) for k in INVENTORY_FIELDS[:-1]], msg,
+                             'DONE', now))
+
+        for pos, changed in delta.get('edited_rows', {}).items():
+            old_row = original_df.iloc[int(pos)]
+            new_row = {k: _db_value(changed.get(k, old_row[k])) for k in INVENTORY_FIELDS}
+            try:
+                updated = conn.execute(
+                    """UPDATE inventory SET name=?, model=?, spec=?, color=?, unit=?, quantity=?, location=?, remark=?,
+                       version = version + 1 WHERE id=? AND version=?""",
+                    (*[new_row[k] for k in INVENTORY_FIELDS], int(old_row['id']), int(old_row['version']))).rowcount
+            except sqlite3.IntegrityError as e:
+                conflict(old_row, f"保存失败: {e}")
+                continue
+            if not updated:
+                conflict(old_row, "已被其他人修改或删除")
+                continue
+            changes = []
+            if old_row['quantity'] != new_row['quantity']: changes.append(
+                f"数量 {old_row['quantity']}->{new_row['quantity']}")
+            if old_row['location'] != new_row['location']: changes.append(
+                f"位置 {old_row['location']}->{new_row['location']}")
+            if old_row['name'] != new_row['name']: changes.append(f"名称变动")
+            if old_row['remark'] != new_row['remark']: changes.append(f"备注变动")
+            if any(_db_value(old_row[k]) != new_row[k] for k in ITEM_KEY_COLS):
+                # 物品键 (名称/型号/规格/颜色/位置) 变化记为旧物品出库 + 新物品入库, 历史库存才能从日志重放
+                change_msg = "管理员修改物品: " + ", ".join(
+                    f"{INVENTORY_COL_MAP[k]} {_db_value(old_row[k])}->{new_row[k]}" for k in INVENTORY_FIELDS[:-1]
+                    if _db_value(old_row[k]) != new_row[k])
+                log_rows.append((applicant, 'ADMIN_DEL', *[_db_value(old_row[k]) for k in INVENTORY_FIELDS[:-1]],
+                                 change_msg, 'DONE', now))
+                log_rows.append((applicant, 'ADMIN_ADD', *[new_row[k] for k in INVENTORY_FIELDS[:-1]], change_msg,
+                                 'DONE', now))
+            elif changes:
+                change_msg = "管理员修改: " + ", ".join(changes)
+                log_rows.append((applicant, 'ADMIN_EDIT', *[new_row[k] for k in INVENTORY_FIELDS[:-1]], change_msg,
+                                 'DONE', now))
+
+        for added in delta.get('added_rows', []):
+            new_row = {k: _db_value(added.get(k)) for k in INVENTORY_FIELDS}
+            try:
+                conn.execute("""INSERT INTO inventory (name, model, spec, color, unit, quantity, location, remark)
+                                VALUES (?,?,?,?,?,?,?,?)""", tuple(new_row[k] for k in INVENTORY_FIELDS))
+            except sqlite3.IntegrityError as e:
+                conflict(new_row, f"保存失败: {e}")
+                continue
+            msg = f"新增了物品: {new_row['name']} (位置: {new_row['location']})"
+            n_name = new_row['name'] if new_row['name'] else "未知"
+            log_rows.append((applicant, 'ADMIN_ADD', n_name, *[new_row[k] for k in INVENTORY_FIELDS[1:-1]], msg,
+                             'DONE', now))
+
+        conn.executemany(LOG_INSERT_SQL, log_rows)
+    return conflicts
+
+
+@retry_on_busy
+def approve_requests(requests, locations):
+    # 批量审批: 同一事务内按物品唯一键分组校验库存, 单条库存不足不影响其余申请.
+    # requests 为待审核日志行 (dict), locations 为 {日志id: 分配的入库位置}; 返回 {日志id: (是否成功, 说明)}
+    results = {}
+    todo = []
+    for req in sorted(requests, key=lambda r: r['id']):
+        location = (locations.get(req['id']) or '').strip().lower() if req['action_type'] == 'IN' else req['location']
+        if not location:
+            results[req['id']] = (False, "❌ 必须分配一个位置")
+        else:
+            todo.append((req, location))
+    if not todo:
+        return results
+
+    with inventory_transaction() as conn:
+        ids = [req['id'] for req, _ in todo]
+        still_pending = {r[0] for r in conn.execute(
+            f"SELECT id FROM logs WHERE status='PENDING' AND id IN ({','.join('?' * len(ids))})", ids)}
+        groups = {}
+        for req, location in todo:
+            if req['id'] not in still_pending:
+                results[req['id']] = (False, "⚠️ 该申请已被处理")
+            else:
+                groups.setdefault((req['name'], req['model'], req['spec'], req['color'], location), []).append(req)
+
+        updates, inserts, deletes, approved = [], [], [], []
+        for key, reqs in groups.items():
+            existing = conn.execute(
+                """SELECT id, quantity, remark, version FROM inventory
+                   WHERE name=? AND model=? AND spec=? AND color=? AND location=?""",
+                key).fetchone()
+            qty, remark = (existing[1], existing[2]) if existing else (0, None)
+            unit, changed = None, False
+            for req in reqs:
+                req_qty = int(req['quantity'])
+                if req['action_type'] == 'IN':
+                    qty += req_qty
+                    remark = req['remark']
+                    unit = unit or req['unit']
+                elif qty >= req_qty:
+                    qty -= req_qty
+                else:
+                    results[req['id']] = (False, "❌ 库存不足")
+                    continue
+                changed = True
+                approved.append((key[4], req['id']))
+                results[req['id']] = (True, "✅ 已批准")
+            if not changed:
+                continue
+            if existing and qty == 0:
+                deletes.append((existing[0], existing[3]))
+            elif existing:
+                updates.append((qty, remark, existing[0], existing[3]))
+            elif qty > 0:
+                inserts.append((*key[:4], unit, qty, key[4], remark))
+
+        conn.executemany("UPDATE inventory SET quantity=?, remark=?, version = version + 1 WHERE id=? AND version=?",
+                         updates)
+        conn.executemany("DELETE FROM inventory WHERE id=? AND version=?", deletes)
+        conn.executemany("""INSERT INTO inventory (name, model, spec, color, unit, quantity, location, remark)
+                            VALUES (?,?,?,?,?,?,?,?)""", inserts)
+        now = datetime.datetime.now()
+        conn.executemany("UPDATE logs SET status='APPROVED', location=?, approved_at=? WHERE id=?",
+                         [(location, now, log_id) for location, log_id in approved])
+    return results
+
+
+@retry_on_busy
+def reject_requests(ids):
+    # 批量拒绝, 仅处理仍为待审核的申请; 返回 {日志id: (是否成功, 说明)}
+    if not ids:
+        return {}
+    with db_transaction(immediate=True) as conn:
+        still_pending = {r[0] for r in conn.execute(
+            f"SELECT id FROM logs WHERE status='PENDING' AND id IN ({','.join('?' * len(ids))})", ids)}
+        conn.executemany("UPDATE logs SET status='REJECTED' WHERE id=?", [(i,) for i in still_pending])
+    return {i: (True, "❌ 已拒绝") if i in still_pending else (False, "⚠️ 该申请已被处理") for i in ids}
+
+
+# 批量导入支持中文或英文表头
+IMPORT_COL_MAP = {'名称': 'name', '型号': 'model', '规格': 'spec', '颜色': 'color', '单位': 'unit',
+                  '数量': 'quantity', '位置': 'location', '备注': 'remark'}
+IMPORT_TEXT_COLS = ['name', 'model', 'spec', 'color', 'unit', 'location', 'remark']
+ITEM_KEY_COLS = ['name', 'model', 'spec', 'color', 'location']
+
+
+def read_import_file(uploaded):
+    if uploaded.name.lower().endswith(('.xlsx', '.xls')):
+        return pd.read_excel(uploaded, dtype=str)
+    try:
+        return pd.read_csv(uploaded, dtype=str, encoding='utf-8-sig')
+    except UnicodeDecodeError:
+        # 中文版 Excel 默认以 GBK 保存 CSV
+        uploaded.seek(0)
+        return pd.read_csv(uploaded, dtype=str, encoding='gb18030')
+
+
+def normalize_import(raw, require_location=True):
+    # 向量化清洗与校验: 与表单一致的 strip().lower(), 返回 (合法行, 错误报告); 行号对应文件中的行 (表头为第 1 行)
+    df = raw.rename(columns=lambda c: IMPORT_COL_MAP.get(str(c).strip(), str(c).strip().lower()))
+    for col in IMPORT_TEXT_COLS + ['quantity']:
+        if col not in df.columns:
+            df[col] = pd.NA
+    df = df[IMPORT_TEXT_COLS + ['quantity']].copy()
+    for col in IMPORT_TEXT_COLS:
+        df[col] = df[col].astype('string').str.strip().str.lower().replace('', pd.NA)
+    df['remark'] = df['remark'].fillna('')
+    df['quantity'] = pd.to_numeric(df['quantity'], errors='coerce')
+    df.index = df.index + 2
+
+    errors = pd.Series('', index=df.index)
+    required = ['name', 'model', 'spec', 'color', 'unit'] + (['location'] if require_location else [])
+    for col in required:
+        errors[df[col].isna()] += f"缺少{INVENTORY_COL_MAP[col]}; "
+    bad_qty = df['quantity'].isna() | (df['quantity'] <= 0) | (df['quantity'] != df['quantity'].round())
+    errors[bad_qty] += "数量须为正整数; "
+
+    valid = df[errors == ''].copy()
+    valid['quantity'] = valid['quantity'].astype(int)
+    valid['location'] = valid['location'].fillna('')
+    report = errors[errors != ''].str.rstrip('; ').rename_axis('行号').reset_index(name='错误')
+    return valid, report
+
+
+@retry_on_busy
+def apply_import(valid, act_code, applicant, is_admin):
+    # 整批导入: 管理员直接在一个事务内按物品唯一键聚合后批量入库/出库, 普通用户批量提交待审核申请.
+    # 返回 (成功行数, 错误报告)
+    now = datetime.datetime.now()
+    log_cols = ['name', 'model', 'spec', 'color', 'unit', 'quantity', 'location', 'remark']
+    if not is_admin:
+        log_rows = [(applicant, act_code, *r, 'PENDING', now) for r in valid[log_cols].itertuples(index=False)]
+        with db_transaction() as conn:
+            conn.executemany(LOG_INSERT_SQL, log_rows)
+        return len(log_rows), pd.DataFrame(columns=['行号', '错误'])
+
+    batch = valid.groupby(ITEM_KEY_COLS, sort=False).agg(
+        quantity=('quantity', 'sum'), unit=('unit', 'first'), remark=('remark', 'last')).reset_index()
+    failed = pd.Series(False, index=batch.index)
+    with inventory_transaction() as conn:
+        conn.execute("""CREATE TEMP TABLE IF NOT EXISTS import_batch
+                        (name TEXT, model TEXT, spec TEXT, color TEXT, location TEXT, unit TEXT, quantity INTEGER,
+                         remark TEXT)""")
+        conn.execute("DELETE FROM import_batch")
+        conn.executemany("INSERT INTO import_batch VALUES (?,?,?,?,?,?,?,?)",
+                         batch[ITEM_KEY_COLS + ['unit', 'quantity', 'remark']].itertuples(index=False))
+        if act_code == 'IN':
+            conn.execute("""INSERT INTO inventory (name, model, spec, color, unit, quantity, location, remark)
+                            SELECT name, model, spec, color, unit, quantity, location, remark FROM import_batch WHERE true
+                            ON CONFLICT (name, model, spec, color, location)
+                            DO UPDATE SET quantity = quantity + excluded.quantity, remark = excluded.remark,
+                                          version = version + 1""")
+        else:
+            # 全部物品都不在库时该列全为 NULL (object 类型), 先转为数值再比较
+            stock = pd.to_numeric(pd.read_sql_query("""SELECT i.quantity FROM import_batch b LEFT JOIN inventory i
+                                                       ON i.name = b.name AND i.model = b.model AND i.spec = b.spec
+                                                       AND i.color = b.color AND i.location = b.location
+                                                       ORDER BY b.rowid""", conn)['quantity'])
+            failed = pd.Series(stock.isna().to_numpy() | (stock.to_numpy() < batch['quantity'].to_numpy()),
+                               index=batch.index)
+            ok = batch[~failed]
+            conn.executemany("""UPDATE inventory SET quantity = quantity - ?, version = version + 1
+                                WHERE name=? AND model=? AND spec=? AND color=? AND location=?""",
+                             ok[['quantity'] + ITEM_KEY_COLS].itertuples(index=False))
+            conn.executemany("""DELETE FROM inventory
+                                WHERE name=? AND model=? AND spec=? AND color=? AND location=? AND quantity = 0""",
+                             ok[ITEM_KEY_COLS].itertuples(index=False))
+        conn.execute("DELETE FROM import_batch")
+
+        failed_keys = batch.loc[failed, ITEM_KEY_COLS]
+        line_failed = valid[ITEM_KEY_COLS].merge(failed_keys, how='left', indicator=True)['_merge'].eq('both').to_numpy()
+        applied = valid[~line_failed]
+        conn.executemany(LOG_INSERT_SQL, [(applicant, act_code, *r, 'APPROVED', now)
+                                          for r in applied[log_cols].itertuples(index=False)])
+    report = pd.DataFrame({'行号': valid.index[line_failed], '错误': "库存不足"})
+    return len(applied), report
+
+
+LOG_TYPE_MAP = {
+    'IN': '入库/更新',
+    'OUT': '领用',
+    'ADMIN_EDIT': '管理员修改',
+    'ADMIN_ADD': '管理员新增',
+    'ADMIN_DEL': '管理员删除'
+}
+LOG_STATUS_MAP = {'PENDING': '⏳ 待审核', 'APPROVED': '✅ 已通过', 'REJECTED': '❌ 已拒绝', 'DONE': '🆗 完成'}
 
 
 # 用于显示日志的中文映射
+LOG_COL_MAP = {
+    'id': '序号', 'applicant': '申请人', 'action_type': '操作类型',
+    'name': '物品名称', 'model': '型号', 'spec': '规格',
+    'color': '颜色', 'unit': '单位', 'quantity': '数量',
+    'location': '位置', 'remark': '备注', 'status': '当前状态',
+    'timestamp': '提交时间', 'approved_at': '审批时间'
+}
+
+
 def format_df_for_display(df):
     if df.empty: return df
-    column_mapping = {
-        'id': '序号', 'applicant': '申请人', 'action_type': '操作类型',
-        'name': '物品名称', 'model': '型号', 'spec': '规格',
-        'color': '颜色', 'unit': '单位', 'quantity': '数量',
-        'location': '位置', 'remark': '备注', 'status': '当前状态',
-        'timestamp': '提交时间'
-    }
-    df_display = df.rename(columns=column_mapping)
+    df_display = df.rename(columns=LOG_COL_MAP)
     if '操作类型' in df_display.columns:
-        type_map = {
-            'IN': '入库/更新',
-            'OUT': '领用',
-            'ADMIN_EDIT': '管理员修改',
-            'ADMIN_ADD': '管理员新增',
-            'ADMIN_DEL': '管理员删除'
-        }
-        df_display['操作类型'] = df_display['操作类型'].map(type_map).fillna(df_display['操作类型'])
+        df_display['操作类型'] = df_display['操作类型'].map(LOG_TYPE_MAP).fillna(df_display['操作类型'])
     if '当前状态' in df_display.columns:
-        status_map = {'PENDING': '⏳ 待审核', 'APPROVED': '✅ 已通过', 'REJECTED': '❌ 已拒绝', 'DONE': '🆗 完成'}
-        df_display['当前状态'] = df_display['当前状态'].map(status_map).fillna(df_display['当前状态'])
+        df_display['当前状态'] = df_display['当前状态'].map(LOG_STATUS_MAP).fillna(df_display['当前状态'])
     return df_display
 
 
+# 已完结的日志状态, 只有这些状态的日志会被归档
+FINAL_LOG_STATUSES = ('APPROVED', 'REJECTED', 'DONE')
+
+
+def list_archive_tables():
+    return [r[0] for r in fetch_all(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name LIKE 'logs_archive_%' ORDER BY name")]
+
+
+@retry_on_busy
+def archive_logs(older_than_days=90):
+    # 将早于指定天数的已完结日志按月份移入 logs_archive_YYYYMM 表, 保持 logs 热表精简; 返回归档条数
+    cutoff = str(datetime.datetime.now() - datetime.timedelta(days=older_than_days))
+    final = f"status IN ({','.join('?' * len(FINAL_LOG_STATUSES))}) AND timestamp < ?"
+    moved = 0
+    with db_transaction(immediate=True) as conn:
+        months = [r[0] for r in conn.execute(
+            f"SELECT DISTINCT substr(timestamp, 1, 7) FROM logs WHERE {final}", (*FINAL_LOG_STATUSES, cutoff))]
+        for month in months:
+            if not month or not re.fullmatch(r"\d{4}-\d{2}", month):
+                continue
+            table = f"logs_archive_{month.replace('-', '')}"
+            where = f"{final} AND substr(timestamp, 1, 7) = ?"
+            params = (*FINAL_LOG_STATUSES, cutoff, month)
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table} {LOGS_TABLE_DDL}")
+            conn.execute(f"INSERT INTO {table} SELECT * FROM logs WHERE {where}", params)
+            # 计数汇总同时覆盖归档日志: 先补回即将被删除触发器扣减的计数
+            for scope, key in LOG_COUNTER_SCOPES:
+                conn.execute(f"""INSERT INTO log_counters (scope, key, status, cnt)
+                                 SELECT {scope}, {key.format(row='logs')}, COALESCE(status, ''), COUNT(*) FROM logs
+                                 WHERE {where} GROUP BY 2, 3
+                                 ON CONFLICT (scope, key, status) DO UPDATE SET cnt = cnt + excluded.cnt""", params)
+            moved += conn.execute(f"DELETE FROM logs WHERE {where}", params).rowcount
+    return moved
+
+
+@retry_on_busy
+def clear_all_logs():
+    # 清空日志前在同一事务中写入检查点, 之后的历史库存从该检查点重放, 不依赖被删除的日志
+    with db_transaction(immediate=True) as conn:
+        write_stock_checkpoint(conn)
+        conn.execute("DELETE FROM logs")
+
+
+def build_log_filter(date_range=(), applicant="", action_types=(), statuses=(), item_name="", include_archive=False):
+    # 日志筛选条件下推到 SQL, 返回 (数据源, WHERE 子句, 参数) 供分页与导出共用
+    source = "logs"
+    if include_archive:
+        # 按日期范围裁剪需要联合查询的月份归档表
+        months = [str(d)[:7].replace('-', '') for d in date_range]
+        tables = [t for t in list_archive_tables()
+                  if not months or (months[0] <= t[-6:] and (len(months) < 2 or t[-6:] <= months[1]))]
+        if tables:
+            source = "(" + " UNION ALL ".join(["SELECT * FROM logs"] + [f"SELECT * FROM {t}" for t in tables]) + ")"
+    clauses, params = [], []
+    if len(date_range) > 0:
+        clauses.append("timestamp >= ?")
+        params.append(str(date_range[0]))
+    if len(date_range) > 1:
+        clauses.append("timestamp < ?")
+        params.append(str(date_range[1] + datetime.timedelta(days=1)))
+    if applicant:
+        clauses.append("applicant = ?")
+        params.append(applicant)
+    if action_types:
+        clauses.append(f"action_type IN ({','.join('?' * len(action_types))})")
+        params.extend(action_types)
+    if statuses:
+        clauses.append(f"status IN ({','.join('?' * len(statuses))})")
+        params.extend(statuses)
+    if item_name:
+        clauses.append("name LIKE ?")
+        params.append(f"%{item_name}%")
+    where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+    return source, where, tuple(params)
+
+
+def fetch_log_page(log_filter, before_id=None, page_size=50):
+    # 基于 id 的键集分页: 只读取当前页 (多取一行用于判断是否还有下一页)
+    source, where, params = log_filter
+    if before_id is not None:
+        where = (where + " AND id < ?") if where else " WHERE id < ?"
+        params = params + (before_id,)
+    page = fetch_df(f"SELECT * FROM {source}{where} ORDER BY id DESC LIMIT ?", params + (page_size + 1,))
+    return page.head(page_size), len(page) > page_size
+
+
+LOG_EXPORT_FORMATS = {'csv': 'text/csv', 'csv.gz': 'application/gzip', 'parquet': 'application/vnd.apache.parquet'}
+
+
+def export_logs(log_filter, fmt='csv', chunksize=5000):
+    # 分块读取日志并逐块汉化写入临时文件 (小文件留在内存, 超过阈值自动落盘), 不在内存中保留整张日志表
+    source, where, params = log_filter
+    out = tempfile.SpooledTemporaryFile(max_size=16 * 1024 * 1024)
+    with db_connection() as conn:
+        rows = pd.read_sql_query(f"SELECT * FROM {source}{where} ORDER BY id DESC", conn, params=params,
+                                 chunksize=chunksize)
+
+        def display_chunks():
+            # 跳过空分块; 没有任何日志时仍输出一个只有中文表头的空表
+            empty = True
+            for chunk in rows:
+                if not chunk.empty:
+                    empty = False
+                    yield format_df_for_display(chunk)
+            if empty:
+                yield pd.DataFrame(columns=list(LOG_COL_MAP.values()))
+
+        chunks = display_chunks()
+        if fmt == 'parquet':
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            writer = None
+            for chunk in chunks:
+                # 固定列类型, 保证各分块的 schema 一致
+                display = chunk.astype('string').astype({'序号': 'Int64', '数量': 'Int64'})
+                table = pa.Table.from_pandas(display, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(out, table.schema, compression='zstd')
+                writer.write_table(table.cast(writer.schema))
+            if writer is not None:
+                writer.close()
+        else:
+            sink = gzip.GzipFile(fileobj=out, mode='wb') if fmt == 'csv.gz' else out
+            for i, chunk in enumerate(chunks):
+                # 仅首块写表头与 BOM (Excel 识别中文)
+                text = chunk.to_csv(index=False, header=(i == 0))
+                sink.write(text.encode('utf-8_sig' if i == 0 else 'utf-8'))
+            if sink is not out:
+                sink.close()
+    out.seek(0)
+    return out
+
+
+# 检查点间隔与保留策略: 最近 CHECKPOINT_KEEP_DAYS 天内全部保留, 更早的每月只保留第一个
+CHECKPOINT_INTERVAL = datetime.timedelta(days=1)
+CHECKPOINT_KEEP_DAYS = 30
+# 重放时各类日志对库存数量的影响: 入库/新增加, 领用/删除减; 管理员修改记录的是修改后的数量
+REPLAY_SIGNS = {'IN': 1, 'OUT': -1, 'ADMIN_ADD': 1, 'ADMIN_DEL': -1, 'ADMIN_EDIT': 0}
+
+
+def write_stock_checkpoint(conn):
+    # 在调用方的事务内保存当前库存的检查点, 并按保留策略清理旧检查点; 返回检查点 id
+    now = datetime.datetime.now()
+    last_log_id = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM sqlite_sequence WHERE name='logs'").fetchone()[0]
+    pending = conn.execute("SELECT id, timestamp FROM logs WHERE status='PENDING'").fetchall()
+    replay_from = min([str(now)] + [str(ts) for _, ts in pending if ts])
+    checkpoint_id = conn.execute(
+        """INSERT INTO stock_checkpoints (taken_at, last_log_id, replay_from, items)
+           VALUES (?, ?, ?, (SELECT COUNT(*) FROM inventory))""", (now, last_log_id, replay_from)).lastrowid
+    conn.execute("""INSERT INTO stock_checkpoint_items
+                    SELECT ?, name, model, spec, color, location, unit, quantity FROM inventory""", (checkpoint_id,))
+    conn.executemany("INSERT INTO stock_checkpoint_pending VALUES (?, ?)", [(checkpoint_id, i) for i, _ in pending])
+
+    expired = [r[0] for r in conn.execute(
+        """SELECT id FROM stock_checkpoints WHERE taken_at < ?
+           AND id NOT IN (SELECT MIN(id) FROM stock_checkpoints GROUP BY substr(taken_at, 1, 7))""",
+        (now - datetime.timedelta(days=CHECKPOINT_KEEP_DAYS),))]
+    for table, col in (('stock_checkpoint_items', 'checkpoint_id'), ('stock_checkpoint_pending', 'checkpoint_id'),
+                       ('stock_checkpoints', 'id')):
+        conn.executemany(f"DELETE FROM {table} WHERE {col}=?", [(i,) for i in expired])
+    return checkpoint_id
+
+
+def _checkpoint_due(latest):
+    return not latest or str(latest) <= str(datetime.datetime.now() - CHECKPOINT_INTERVAL)
+
+
+def checkpoint_if_due(force=False):
+    # 距上一个检查点超过 CHECKPOINT_INTERVAL (或 force) 时新建检查点; 返回新检查点 id, 未新建时返回 None.
+    # 先用普通读取判断是否到期, 只有确实需要新建时才获取写锁, 并在锁内再确认一次
+    if not force and not _checkpoint_due(fetch_scalar("SELECT MAX(taken_at) FROM stock_checkpoints")):
+        return None
+    with db_transaction(immediate=True) as conn:
+        if not force and not _checkpoint_due(conn.execute("SELECT MAX(taken_at) FROM stock_checkpoints").fetchone()[0]):
+            return None
+        return write_stock_checkpoint(conn)
+
+
+@retry_on_busy
+def create_stock_checkpoint(force=False):
+    return checkpoint_if_due(force)
+
+
+def maybe_create_stock_checkpoint():
+    # 管理员登录后的自动检查点: 每个会话每天最多检查一次; 不重试, 写锁被占用时跳过, 不影响页面渲染
+    today = datetime.date.today()
+    if st.session_state.get('checkpoint_checked') == today:
+        return
+    try:
+        checkpoint_if_due()
+    except sqlite3.OperationalError as e:
+        logger.warning("skipped stock checkpoint: %s", e)
+        return
+    st.session_state.checkpoint_checked = today
+
+
+def stock_as_of(as_of):
+    # 重建指定时间点的库存: 取该时间点之前最近的检查点, 只重放其后的增量日志 (含归档); 没有检查点时从空库存重放.
+    # 审核通过的申请按审批时间 (approved_at) 生效, 其余日志 (及记录审批时间之前的旧日志) 按提交时间
+    as_of = pd.Timestamp(as_of).to_pydatetime()
+    checkpoint = fetch_one("""SELECT id, last_log_id, replay_from FROM stock_checkpoints
+                              WHERE taken_at <= ? ORDER BY taken_at DESC LIMIT 1""", (as_of,), records=True)
+    if checkpoint:
+        base = fetch_df("""SELECT name, model, spec, color, location, unit, quantity FROM stock_checkpoint_items
+                           WHERE checkpoint_id=?""", (checkpoint.id,))
+        checkpoint_id, last_log_id = checkpoint.id, checkpoint.last_log_id
+        since = pd.Timestamp(checkpoint.replay_from).date()
+    else:
+        base = pd.DataFrame(columns=ITEM_KEY_COLS + ['unit', 'quantity'])
+        checkpoint_id, last_log_id, since = None, 0, datetime.date.min
+
+    source, where, params = build_log_filter((since, as_of.date()), action_types=tuple(REPLAY_SIGNS),
+                                             statuses=('APPROVED', 'DONE'), include_archive=True)
+    delta = fetch_df(
+        f"""SELECT id, COALESCE(approved_at, timestamp) AS effective_at, action_type,
+                   name, model, spec, color, location, unit, quantity FROM {source}{where}
+            AND COALESCE(approved_at, timestamp) <= ?
+            AND (id > ? OR id IN (SELECT log_id FROM stock_checkpoint_pending WHERE checkpoint_id = ?))""",
+        params + (as_of, last_log_id, checkpoint_id))
+    # 按生效时间排序后的序号; 先提交后审批的申请可能晚于 id 更大的日志生效
+    delta = delta.sort_values(['effective_at', 'id'], ignore_index=True)
+    delta['seq'] = np.arange(len(delta))
+
+    base[ITEM_KEY_COLS] = base[ITEM_KEY_COLS].fillna('')
+    delta[ITEM_KEY_COLS] = delta[ITEM_KEY_COLS].fillna('')
+    delta['quantity'] = delta['quantity'].fillna(0)
+    # 每个物品最后一次管理员修改给出绝对数量, 之后的日志按增减量累加
+    edits = (delta[delta['action_type'] == 'ADMIN_EDIT'].groupby(ITEM_KEY_COLS).tail(1)
+             .rename(columns={'seq': 'edit_seq', 'quantity': 'edit_qty'})[ITEM_KEY_COLS + ['edit_seq', 'edit_qty']])
+    delta = delta.merge(edits, on=ITEM_KEY_COLS, how='left')
+    after_edit = delta['edit_seq'].isna().to_numpy() | (delta['seq'] > delta['edit_seq']).to_numpy()
+    delta['change'] = np.where(after_edit, delta['action_type'].map(REPLAY_SIGNS).to_numpy() * delta['quantity'], 0)
+    moved = delta.groupby(ITEM_KEY_COLS).agg(change=('change', 'sum'), log_unit=('unit', 'last')).reset_index()
+
+    stock = base.merge(edits, on=ITEM_KEY_COLS, how='outer').merge(moved, on=ITEM_KEY_COLS, how='outer')
+    stock['quantity'] = (np.where(stock['edit_qty'].notna(), stock['edit_qty'], stock['quantity'].fillna(0))
+                         + stock['change'].fillna(0)).astype(int)
+    stock['unit'] = stock['unit'].fillna(stock['log_unit'])
+    stock = stock[stock['quantity'] > 0]
+    return stock[ITEM_KEY_COLS + ['unit', 'quantity']].sort_values(ITEM_KEY_COLS, ignore_index=True)
+
+
+def diff_stock(start, end):
+    # 对比两个时间点的库存, 只返回数量有变化的物品
+    merged = stock_as_of(start).merge(stock_as_of(end), on=ITEM_KEY_COLS, how='outer', suffixes=('_start', '_end'))
+    merged['unit'] = merged['unit_end'].fillna(merged['unit_start'])
+    merged[['quantity_start', 'quantity_end']] = merged[['quantity_start', 'quantity_end']].fillna(0).astype(int)
+    merged['change'] = merged['quantity_end'] - merged['quantity_start']
+    return merged.loc[merged['change'] != 0, ITEM_KEY_COLS + ['unit', 'quantity_start', 'quantity_end', 'change']]
+
+
+@st.cache_data(max_entries=8)
+def load_stock_analytics(version, today, window_days=30, cover_days=14):
+    # 基于每日汇总表的库存分析 (按库存版本号与日期缓存); 只读取窗口内的汇总行, 与日志总量无关.
+    # 返回 (物品指标, 每日趋势, 位置汇总, 申请人汇总)
+    since = str(today - datetime.timedelta(days=window_days - 1))
+    daily = fetch_df("""SELECT scope, key, day, in_qty, out_qty, moves FROM stock_daily
+                        WHERE day >= ? AND scope IN ('location', 'applicant', 'item')""", (since,))
+    by_scope = {scope: g.drop(columns='scope') for scope, g in daily.groupby('scope')}
+    empty = pd.DataFrame(columns=['key', 'day', 'in_qty', 'out_qty', 'moves'])
+
+    def totals(scope):
+        return (by_scope.get(scope, empty).groupby('key')[['in_qty', 'out_qty', 'moves']].sum()
+                .sort_values('out_qty', ascending=False))
+
+    trend = (by_scope.get('location', empty).groupby('day')[['in_qty', 'out_qty']].sum()
+             .reindex(pd.date_range(since, today).strftime('%Y-%m-%d'), fill_value=0))
+
+    demand = totals('item').reset_index()
+    demand[ITEM_KEY_COLS] = demand['key'].str.split('\x1f', expand=True).reindex(columns=range(5), fill_value='')
+    stock = load_inventory_snapshot(version)[ITEM_KEY_COLS + ['unit', 'quantity']].copy()
+    stock[ITEM_KEY_COLS] = stock[ITEM_KEY_COLS].fillna('')
+    items = stock.merge(demand.drop(columns='key'), on=ITEM_KEY_COLS, how='outer')
+    items[['quantity', 'in_qty', 'out_qty', 'moves']] = items[['quantity', 'in_qty', 'out_qty', 'moves']].fillna(0)
+
+    qty = items['quantity'].to_numpy(dtype=float)
+    out_qty = items['out_qty'].to_numpy(dtype=float)
+    daily_out = out_qty / window_days
+    # 窗口平均库存按期初 (当前 - 入库 + 领用) 与期末的均值估算
+    avg_stock = qty + (out_qty - items['in_qty'].to_numpy(dtype=float)) / 2
+    items['daily_out'] = daily_out
+    items['turnover'] = np.divide(out_qty, avg_stock, out=np.zeros_like(qty), where=avg_stock > 0)
+    items['days_of_cover'] = np.divide(qty, daily_out, out=np.full_like(qty, np.inf), where=daily_out > 0)
+    items['reorder_qty'] = np.maximum(np.ceil(daily_out * cover_days - qty), 0)
+    items['low_stock'] = items['days_of_cover'] < cover_days
+    items = items.sort_values(['low_stock', 'days_of_cover'], ascending=[False, True], ignore_index=True)
+    return items, trend, totals('location'), totals('applicant')
+
+
+def get_stock_analytics(window_days=30, cover_days=14):
+    return load_stock_analytics(get_data_versions().get('inventory'), datetime.date.today(), window_days, cover_days)
+
+
 # 用于显示库存的中文映射字典 (只读模式用)
 INVENTORY_COL_MAP = {
     'id': '序号', 'name': '名称', 'model': '型号', 'spec': '规格',
@@ -120,346 +1230,582 @@ def login_system():
             st.rerun()
 
 
+def update_profiler_settings():
+    # 分析器是进程级共享的, 只在管理员实际修改控件时写入
+    profiler = get_query_profiler()
+    profiler.enabled = st.session_state.profiler_enabled
+    profiler.slow_ms = st.session_state.profiler_slow_ms
+
+
+def render_query_profile():
+    # 管理员侧边栏: 查询性能分析开关与本次重跑的耗时明细
+    profiler = get_query_profiler()
+    # 控件使用固定 key, 渲染前同步为当前的全局设置 (其他管理员可能已修改)
+    st.session_state.profiler_enabled = profiler.enabled
+    st.session_state.profiler_slow_ms = float(profiler.slow_ms)
+    with st.sidebar.expander("🔍 查询性能分析"):
+        st.checkbox("启用", key="profiler_enabled", on_change=update_profiler_settings)
+        st.number_input("慢查询阈值 (ms)", min_value=1.0, step=50.0, key="profiler_slow_ms",
+                        on_change=update_profiler_settings)
+        if not profiler.enabled:
+            return
+        records = pd.DataFrame(profiler.rerun_records(), columns=['sql', 'ms', 'rows', 'df_ms'])
+        st.caption(f"本次重跑: {len(records)} 条查询, SQL {records['ms'].sum():.1f} ms, "
+                   f"DataFrame {records['df_ms'].sum():.1f} ms")
+        st.dataframe(records.sort_values('ms', ascending=False).rename(
+            columns={'sql': '语句', 'ms': '耗时(ms)', 'rows': '行数', 'df_ms': 'DataFrame(ms)'}),
+            use_container_width=True, hide_index=True)
+        if profiler.slow_queries:
+            st.caption("最近的慢查询")
+            st.dataframe(pd.DataFrame(profiler.slow_queries), use_container_width=True, hide_index=True)
+        with db_connection() as conn:
+            profiler.flush(conn, force=st.button("写入统计"))
+        metrics = fetch_df("SELECT * FROM query_metrics ORDER BY total_ms DESC")
+        st.download_button("📥 导出查询统计", data=metrics.to_csv(index=False).encode('utf-8_sig'),
+                           file_name='query_metrics.csv', mime='text/csv')
+
+
 # --- 3. 界面主逻辑 ---
+# 页面拆分为可独立重跑的片段 (st.fragment): 控件交互只重跑所在片段, 写操作的回调用 st.rerun([...]) 只刷新受影响的片段
+@st.cache_resource
+def init_db_once(db_file):
+    # 建表/迁移每个进程 (每个数据库文件) 只执行一次
+    init_db()
+
+
+def show_message(key):
+    # 显示并清除回调留下的提示 (级别, 文本)
+    if key in st.session_state:
+        level, msg = st.session_state.pop(key)
+        getattr(st, level)(msg)
+
+
+@st.fragment(key="pending_badge")
+def render_pending_badge(where):
+    # 待审核角标: 审批/提交后与对应片段一起重跑即可刷新
+    pending_count = fetch_scalar("SELECT cnt FROM log_counters WHERE scope='all' AND key='' AND status='PENDING'",
+                                 default=0)
+    if where == 'sidebar':
+        if pending_count > 0:
+            st.error(f"🔔 提示：有 {pending_count} 条申请待审批！")
+    elif where == 'work':
+        if pending_count > 0:
+            st.warning(f"⚠️ 注意：有 {pending_count} 条申请需要审批！")
+    elif pending_count > 0:
+        st.warning(f"🔔 待处理: {pending_count} 条")
+    else:
+        st.success("✨ 无待办任务")
+
+
+def submit_operation(selected_id):
+    # 物品操作表单的提交回调
+    ss = st.session_state
+    act_code = 'IN' if "入库" in ss.op_action else 'OUT'
+    is_user_in = ss.user_role == 'user' and act_code == 'IN'
+    name, model, spec, color, unit = (str(ss.get(f"op_{k}_{selected_id}") or "").strip().lower()
+                                      for k in ('name', 'model', 'spec', 'color', 'unit'))
+    location = "" if is_user_in else str(ss.get(f"op_location_{selected_id}") or "").strip().lower()
+    quantity = ss[f"op_quantity_{selected_id}"]
+    remark = ss.get(f"op_remark_{selected_id}", "")
+
+    if not (name and model and spec and color and unit) or (not is_user_in and not location):
+        ss.op_message = ('error', "❌ 必填项不完整！")
+        return
+    if ss.user_role == 'admin':
+        new_qty = admin_stock_move(act_code, 'admin', name, model, spec, color, unit, quantity, location, remark)
+        if new_qty is None:
+            ss.op_message = ('error', "❌ 库存不足")
+            return
+        ss.op_message = ('success', f"✅ 入库成功，现数量: {new_qty}" if act_code == 'IN' else "✅ 领用成功")
+        st.rerun(["op_form", "inventory_table", "global_log"])
+    else:
+        run_query("""INSERT INTO logs
+                  (applicant, action_type, name, model, spec, color, unit, quantity, location, remark, status, timestamp)
+                  VALUES (?,?,?,?,?,?,?,?,?,?,?,?)""",
+                  (ss.username, act_code, name, model, spec, color, unit, quantity, location, remark, 'PENDING',
+                   datetime.datetime.now()))
+        ss.op_message = ('success', "✅ 申请提交成功！")
+        st.rerun(["op_form", "my_submissions", "global_log"])
+
+
+@st.fragment(key="op_form")
+def render_op_form():
+    col_type, col_search, col_select = st.columns([1, 1, 2])
+    with col_type:
+        action_type = st.radio("操作类型", ["入库/更新 (IN)", "领用 (OUT)"], horizontal=True, key="op_action")
+    with col_search:
+        search_text = st.text_input("🔍 搜索库存", placeholder="名称 / 型号 / 规格 / 颜色 / 位置",
+                                    key="inventory_search")
+    # 只把检索命中的前 20 条发送给下拉框
+    matches = {r['id']: r for r in search_inventory(search_text)}
+    with col_select:
+        selected_id = st.selectbox(
+            "📦 快速选择库存", [None] + list(matches),
+            format_func=lambda i: "(新商品 / 手动输入)" if i is None else
+            f"{matches[i]['name']} | {matches[i]['model']} | {matches[i]['location']}")
+
+    default_val = {k: "" for k in ['name', 'model', 'spec', 'color', 'unit', 'location', 'remark']}
+    if selected_id is not None:
+        row = matches[selected_id]
+        for k in default_val.keys(): default_val[k] = row[k]
+
+    show_message('op_message')
+    # 表单控件的 key 带上所选库存 id, 切换库存时以其字段作为新的默认值
+    with st.form("op_form"):
+        c1, c2, c3, c4 = st.columns(4)
+        with c1:
+            st.text_input("名称", value=default_val['name'], key=f"op_name_{selected_id}")
+            st.text_input("颜色", value=default_val['color'], key=f"op_color_{selected_id}")
+        with c2:
+            st.text_input("型号", value=default_val['model'], key=f"op_model_{selected_id}")
+            st.text_input("单位", value=default_val['unit'], key=f"op_unit_{selected_id}")
+        with c3:
+            st.text_input("规格", value=default_val['spec'], key=f"op_spec_{selected_id}")
+            if st.session_state.user_role == 'user' and "入库" in action_type:
+                st.info("📍 位置将由管理员分配")
+            else:
+                st.text_input("位置", value=default_val['location'], key=f"op_location_{selected_id}")
+        with c4:
+            st.number_input("数量", min_value=1, step=1, value=1, key=f"op_quantity_{selected_id}")
+            st.text_input("备注", value=default_val['remark'], key=f"op_remark_{selected_id}")
+
+        st.form_submit_button("提交执行", on_click=submit_operation, args=(selected_id,))
+
+
+@st.fragment(key="my_submissions")
+def render_my_submissions():
+    st.subheader("📋 我的提交记录")
+    my_logs = fetch_df(
+        "SELECT id, action_type, name, spec, quantity, location, status, timestamp, remark FROM logs WHERE applicant=? ORDER BY id DESC",
+        (st.session_state.username,))
+    if not my_logs.empty:
+        st.dataframe(format_df_for_display(my_logs), use_container_width=True, hide_index=True)
+
+
+def save_inventory_table(editor_key):
+    # 库存表格保存回调
+    ss = st.session_state
+    delta = ss.get(editor_key, {})
+    try:
+        # 只提交编辑增量, 避免整表删除重写
+        conflicts = save_inventory_edits(ss.inventory_editor_base, delta)
+    except Exception as e:
+        ss.inventory_message = ('error', f"保存失败: {e}")
+        return
+    # 换新的编辑器实例并丢弃旧快照, 下次渲染使用最新库存
+    ss.inventory_editor_gen += 1
+    del ss.inventory_editor_base
+    if conflicts:
+        ss.inventory_conflicts = conflicts
+        saved = sum(len(delta.get(k, [])) for k in ('edited_rows', 'added_rows', 'deleted_rows')) - len(conflicts)
+        ss.inventory_message = ('warning', f"⚠️ 部分保存：已保存 {saved} 行，跳过 {len(conflicts)} 行") if saved \
+            else ('error', f"❌ 保存失败：已保存 0 行，跳过 {len(conflicts)} 行")
+    else:
+        ss.inventory_message = ('success', "✅ 保存成功！")
+    st.rerun(["inventory_table", "op_form", "global_log"])
+
+
+@st.fragment(key="inventory_table")
+def render_inventory_table():
+    # --- B. 库存明细 (汉化版) ---
+    st.subheader("📊 库存明细表")
+    original_df = get_inventory_snapshot()
+
+    if st.session_state.user_role == 'admin':
+        st.info("💡 管理员提示：双击单元格修改，+号新增，选中行删除。操作后请点击【保存表格修改】。")
+
+        # 有未保存的编辑时固定编辑开始时的快照, 保存时据其行版本号检测并发冲突
+        editor_key = f"inventory_editor_{st.session_state.setdefault('inventory_editor_gen', 0)}"
+        editor_delta = st.session_state.get(editor_key, {})
+        has_edits = any(editor_delta.get(k) for k in ('edited_rows', 'added_rows', 'deleted_rows'))
+        if not has_edits or 'inventory_editor_base' not in st.session_state:
+            st.session_state.inventory_editor_base = original_df
+        editor_base = st.session_state.inventory_editor_base
+
+        show_message('inventory_message')
+        if 'inventory_conflicts' in st.session_state:
+            conflicts = st.session_state.pop('inventory_conflicts')
+            st.warning(f"⚠️ {len(conflicts)} 行未保存：编辑期间已被其他人修改或不满足约束，请核对后重新编辑")
+            st.dataframe(pd.DataFrame(conflicts), use_container_width=True, hide_index=True)
+
+        # 🟢 汉化关键点：使用 column_config 将英文字段映射为中文显示
+        st.data_editor(
+            editor_base,
+            key=editor_key,
+            column_config={
+                "id": st.column_config.NumberColumn("序号", disabled=True),
+                "version": None,
+                "name": st.column_config.TextColumn("名称"),
+                "model": st.column_config.TextColumn("型号"),
+                "spec": st.column_config.TextColumn("规格"),
+                "color": st.column_config.TextColumn("颜色"),
+                "unit": st.column_config.TextColumn("单位"),
+                "quantity": st.column_config.NumberColumn("数量"),
+                "location": st.column_config.TextColumn("位置"),
+                "remark": st.column_config.TextColumn("备注")
+            },
+            use_container_width=True,
+            num_rows="dynamic"
+        )
+
+        col_save, col_del = st.columns([1, 6])
+        with col_save:
+            st.button("💾 保存表格修改", on_click=save_inventory_table, args=(editor_key,))
+
+    else:
+        # 普通用户：直接翻译表头
+        df_display = original_df.drop(columns=['version']).rename(columns=INVENTORY_COL_MAP)
+        st.dataframe(df_display, use_container_width=True, hide_index=True)
+
+
+def clear_logs():
+    clear_all_logs()
+    st.session_state.log_message = ('success', "日志已清空")
+    st.rerun(["global_log", "pending_badge"])
+
+
+@st.fragment(key="global_log")
+def render_global_log():
+    # --- C. 全局日志管理 ---
+    st.subheader("📝 全局操作日志")
+    f1, f2, f3, f4, f5, f6 = st.columns([2, 1, 2, 2, 1, 1])
+    with f1:
+        log_dates = st.date_input("日期范围", value=(), key="log_dates")
+    with f2:
+        log_applicant = st.text_input("申请人", key="log_applicant").strip()
+    with f3:
+        log_types = st.multiselect("操作类型", list(LOG_TYPE_MAP), format_func=LOG_TYPE_MAP.get, key="log_types")
+    with f4:
+        log_statuses = st.multiselect("当前状态", list(LOG_STATUS_MAP), format_func=LOG_STATUS_MAP.get,
+                                      key="log_statuses")
+    with f5:
+        log_item = st.text_input("物品名称", key="log_item").strip().lower()
+    with f6:
+        page_size = st.selectbox("每页条数", [20, 50, 100, 200], index=1, key="log_page_size")
+    include_archive = st.checkbox("包含归档日志", key="log_include_archive")
+
+    log_filter = build_log_filter(log_dates, log_applicant, log_types, log_statuses, log_item, include_archive)
+    # 筛选条件或每页条数变化时回到第一页
+    if st.session_state.get('log_filter_key') != (log_filter, page_size):
+        st.session_state.log_filter_key = (log_filter, page_size)
+        st.session_state.log_cursors = []
+    cursors = st.session_state.log_cursors
+    page_logs, has_next = fetch_log_page(log_filter, cursors[-1] if cursors else None, page_size)
+
+    show_message('log_message')
+    if not page_logs.empty:
+        st.dataframe(format_df_for_display(page_logs), use_container_width=True, hide_index=True)
+    else:
+        st.info("没有符合条件的日志")
+
+    p1, p2, p3 = st.columns([1, 1, 6])
+    with p1:
+        # 翻页在回调中移动游标, 本片段随后重跑即显示新页
+        st.button("⬅️ 上一页", disabled=not cursors, on_click=cursors.pop)
+    with p2:
+        st.button("下一页 ➡️", disabled=not has_next, on_click=cursors.append,
+                  args=(int(page_logs['id'].iloc[-1]) if has_next else None,))
+    with p3:
+        st.caption(f"第 {len(cursors) + 1} 页")
+
+    if not page_logs.empty:
+        col1, col2 = st.columns([1, 4])
+        with col1:
+            export_fmt = st.selectbox("导出格式", list(LOG_EXPORT_FORMATS), key="log_export_fmt")
+            if export_fmt == 'parquet' and importlib.util.find_spec('pyarrow') is None:
+                st.error("导出 Parquet 需要安装 pyarrow")
+            else:
+                # 导出按需生成: 点击下载时才从数据库分块读取筛选结果, 渲染时不读取
+                st.download_button(
+                    label="📥 导出日志",
+                    data=lambda: export_logs(log_filter, export_fmt),
+                    file_name=f'logs_{datetime.datetime.now().strftime("%Y%m%d")}.{export_fmt}',
+                    mime=LOG_EXPORT_FORMATS[export_fmt],
+                    on_click="ignore"
+                )
+        with col2:
+            if st.session_state.user_role == 'admin':
+                with st.expander("⚠️ 清理日志"):
+                    st.button("🔴 确认清空", on_click=clear_logs)
+                with st.expander("🗄️ 日志归档"):
+                    archive_days = st.number_input("归档多少天前的已完结日志", min_value=1, step=1, value=90)
+                    if st.button("📦 执行归档"):
+                        moved = archive_logs(int(archive_days))
+                        st.success(f"已归档 {moved} 条日志")
+                    archives = list_archive_tables()
+                    if archives:
+                        st.caption("已有归档: " + ", ".join(t[-6:] for t in archives))
+
+
+def approve_card(row):
+    # 入库申请使用卡片上填写的分配位置
+    location = st.session_state.get(f"loc_{row['id']}", "") if row['action_type'] == 'IN' else row['location']
+    approved, msg = approve_requests([row], {row['id']: location})[row['id']]
+    st.session_state[f"card_result_{row['id']}"] = ('success', "已批准", True) if approved else ('error', msg, False)
+    st.rerun([f"approval_card_{row['id']}", "pending_badge"])
+
+
+def reject_card(row):
+    rejected, msg = reject_requests([row['id']])[row['id']]
+    st.session_state[f"card_result_{row['id']}"] = ('error', "已拒绝", True) if rejected else ('warning', msg, False)
+    st.rerun([f"approval_card_{row['id']}", "pending_badge"])
+
+
+def render_approval_card(row):
+    # 单条审批卡片 (每张卡片是独立片段, key 为 approval_card_<id>)
+    with st.container(border=True):
+        cols = st.columns([4, 2, 1])
+        with cols[0]:
+            type_str = "🟢 申请入库" if row['action_type'] == 'IN' else "🔴 申请领用"
+            st.markdown(f"**{type_str}** | 申请人: {row['applicant']}")
+            st.write(f"物品: **{row['name']}** | 数量: **{row['quantity']} {row['unit']}**")
+            st.text(f"详情: {row['model']} | {row['spec']} | {row['color']}")
+            if row['action_type'] == 'OUT': st.text(f"领用位置: {row['location']}")
+            st.text(f"备注: {row['remark']}")
+
+        level, msg, done = st.session_state.pop(f"card_result_{row['id']}", (None, None, False))
+        if done:
+            # 已处理的卡片只显示结果, 下次整页刷新时从待办列表中移除
+            with cols[1]:
+                getattr(st, level)(msg)
+            return
+
+        with cols[1]:
+            if row['action_type'] == 'IN':
+                st.text_input(f"📍 分配入库位置 (必填)", key=f"loc_{row['id']}")
+
+            st.button("批准", key=f"ok_{row['id']}", on_click=approve_card, args=(row,))
+            if level:
+                getattr(st, level)(msg)
+
+        with cols[2]:
+            st.write("")
+            st.button("拒绝", key=f"no_{row['id']}", on_click=reject_card, args=(row,))
+
+
 def main():
     st.set_page_config(page_title="仓管系统", layout="wide")
-    init_db()
+    get_query_profiler().start_rerun()
+    init_db_once(DB_FILE)
     login_system()
 
     if not st.session_state.logged_in: return
+    if st.session_state.user_role == 'admin':
+        maybe_create_stock_checkpoint()
 
-    # 提醒逻辑
-    pending_count = 0
+    # 提醒逻辑 (导航项名称固定, 待办数量变化不会重置当前页面)
     approval_menu_name = "✅ 审批中心"
     if st.session_state.user_role == 'admin':
-        res = run_query("SELECT COUNT(*) as cnt FROM logs WHERE status='PENDING'")
-        if not res.empty: pending_count = res.iloc[0]['cnt']
-        if pending_count > 0:
-            approval_menu_name = f"✅ 审批中心 (🔴 {pending_count} 待办)"
-            st.sidebar.error(f"🔔 提示：有 {pending_count} 条申请待审批！")
+        with st.sidebar:
+            render_pending_badge('sidebar')
 
-    menu = ["🏭 仓库作业中心", approval_menu_name]
+    menu = ["🏭 仓库作业中心", approval_menu_name, "📈 库存分析"]
     if st.session_state.user_role != 'admin': menu = ["🏭 仓库作业中心"]
     choice = st.sidebar.radio("导航", menu)
 
     # ================= 核心功能区 =================
     if choice == "🏭 仓库作业中心":
-        if st.session_state.user_role == 'admin' and pending_count > 0:
-            st.warning(f"⚠️ 注意：有 {pending_count} 条申请需要审批！")
+        if st.session_state.user_role == 'admin':
+            render_pending_badge('work')
 
         st.markdown("### 🛠️ 物品操作区")
+        render_op_form()
 
-        df_inventory = run_query("SELECT * FROM inventory")
-        options = ["(新商品 / 手动输入)"]
-        if not df_inventory.empty:
-            df_inventory['label'] = df_inventory['name'] + " | " + df_inventory['model'] + " | " + df_inventory[
-                'location']
-            options += df_inventory['label'].tolist()
-
-        col_type, col_select = st.columns([1, 3])
-        with col_type:
-            action_type = st.radio("操作类型", ["入库/更新 (IN)", "领用 (OUT)"], horizontal=True)
-        with col_select:
-            selected_item = st.selectbox("📦 快速选择库存", options)
-
-        default_val = {k: "" for k in ['name', 'model', 'spec', 'color', 'unit', 'location', 'remark']}
-        if selected_item != "(新商品 / 手动输入)":
-            row = df_inventory[df_inventory['label'] == selected_item].iloc[0]
-            for k in default_val.keys(): default_val[k] = row[k]
-
-        with st.form("op_form"):
-            c1, c2, c3, c4 = st.columns(4)
-            with c1:
-                name = st.text_input("名称", value=default_val['name'])
-                color = st.text_input("颜色", value=default_val['color'])
-            with c2:
-                model = st.text_input("型号", value=default_val['model'])
-                unit = st.text_input("单位", value=default_val['unit'])
-            with c3:
-                spec = st.text_input("规格", value=default_val['spec'])
-                is_user_in = (st.session_state.user_role == 'user' and "入库" in action_type)
-                if is_user_in:
-                    st.info("📍 位置将由管理员分配")
-                    location = ""
+        with st.expander("📥 批量导入 (CSV / Excel)"):
+            st.caption("表头: 名称, 型号, 规格, 颜色, 单位, 数量, 位置, 备注 (也可使用英文列名)。"
+                       + ("普通用户入库申请的位置由管理员分配。" if st.session_state.user_role == 'user' else ""))
+            import_action = st.radio("导入类型", ["入库/更新 (IN)", "领用 (OUT)"], horizontal=True, key="import_action")
+            import_file = st.file_uploader("选择文件", type=['csv', 'xlsx', 'xls'], key="import_file")
+            if import_file is not None and st.button("开始导入"):
+                import_code = 'IN' if "入库" in import_action else 'OUT'
+                is_admin = st.session_state.user_role == 'admin'
+                try:
+                    raw = read_import_file(import_file)
+                except ImportError:
+                    st.error("读取 Excel 需要安装 openpyxl")
+                except ValueError as e:
+                    # 包括编码错误 (UnicodeDecodeError) 与格式错误 (pandas ParserError)
+                    st.error(f"❌ 无法读取文件: {e}")
                 else:
-                    location = st.text_input("位置", value=default_val['location'])
-            with c4:
-                quantity = st.number_input("数量", min_value=1, step=1, value=1)
-                remark = st.text_input("备注", value=default_val['remark'])
-
-            submit_btn = st.form_submit_button("提交执行")
-
-            if submit_btn:
-                name = name.strip().lower()
-                model = model.strip().lower()
-                spec = spec.strip().lower()
-                color = color.strip().lower()
-                unit = unit.strip().lower()
-                if not is_user_in: location = location.strip().lower()
-
-                valid = True
-                if not (name and model and spec and color and unit): valid = False
-                if not is_user_in and not location: valid = False
-
-                if not valid:
-                    st.error("❌ 必填项不完整！")
-                else:
-                    act_code = 'IN' if "入库" in action_type else 'OUT'
-                    if st.session_state.user_role == 'admin':
-                        check_sql = "SELECT id, quantity FROM inventory WHERE name=? AND model=? AND spec=? AND location=? AND color=?"
-                        existing = run_query(check_sql, (name, model, spec, location, color))
-                        if act_code == 'IN':
-                            if not existing.empty:
-                                new_qty = existing.iloc[0]['quantity'] + quantity
-                                run_query("UPDATE inventory SET quantity=?, remark=? WHERE id=?",
-                                          (int(new_qty), remark, int(existing.iloc[0]['id'])))
-                                st.success(f"✅ 库存更新成功，现数量: {new_qty}")
-                            else:
-                                run_query(
-                                    "INSERT INTO inventory (name, model, spec, color, unit, quantity, location, remark) VALUES (?,?,?,?,?,?,?,?)",
-                                    (name, model, spec, color, unit, quantity, location, remark))
-                                st.success(f"✅ 新物品入库成功")
-                            run_query(
-                                "INSERT INTO logs (applicant, action_type, name, model, spec, color, unit, quantity, location, remark, status, timestamp) VALUES (?,?,?,?,?,?,?,?,?,?,?,?)",
-                                ('admin', 'IN', name, model, spec, color, unit, quantity, location, remark, 'APPROVED',
-                                 datetime.datetime.now()))
-                        else:  # OUT
-                            if existing.empty or existing.iloc[0]['quantity'] < quantity:
-                                st.error("❌ 库存不足")
-                            else:
-                                new_qty = existing.iloc[0]['quantity'] - quantity
-                                if new_qty == 0:
-                                    run_query("DELETE FROM inventory WHERE id=?", (int(existing.iloc[0]['id']),))
-                                else:
-                                    run_query("UPDATE inventory SET quantity=? WHERE id=?",
-                                              (int(new_qty), int(existing.iloc[0]['id'])))
-                                st.success(f"✅ 领用成功")
-                                run_query(
-                                    "INSERT INTO logs (applicant, action_type, name, model, spec, color, unit, quantity, location, remark, status, timestamp) VALUES (?,?,?,?,?,?,?,?,?,?,?,?)",
-                                    ('admin', 'OUT', name, model, spec, color, unit, quantity, location, remark,
-                                     'APPROVED', datetime.datetime.now()))
-                        st.rerun()
-                    else:
-                        run_query("""INSERT INTO logs 
-                                  (applicant, action_type, name, model, spec, color, unit, quantity, location, remark, status, timestamp) 
-                                  VALUES (?,?,?,?,?,?,?,?,?,?,?,?)""",
-                                  (st.session_state.username, act_code, name, model, spec, color, unit, quantity,
-                                   location, remark, 'PENDING', datetime.datetime.now()))
-                        st.success("✅ 申请提交成功！")
-                        st.rerun()
+                    valid, report = normalize_import(raw, require_location=is_admin or import_code == 'OUT')
+                    applied, stock_report = apply_import(valid, import_code, st.session_state.username, is_admin)
+                    report = pd.concat([report, stock_report]).sort_values('行号')
+                    st.success(f"✅ 成功导入 {applied} 行" + ("" if is_admin else "，等待管理员审批"))
+                    if not report.empty:
+                        st.error(f"❌ {len(report)} 行未导入")
+                        st.dataframe(report, use_container_width=True, hide_index=True)
 
         if st.session_state.user_role == 'user':
             st.markdown("---")
-            st.subheader("📋 我的提交记录")
-            my_logs = run_query(
-                "SELECT id, action_type, name, spec, quantity, location, status, timestamp, remark FROM logs WHERE applicant=? ORDER BY id DESC",
-                (st.session_state.username,))
-            if not my_logs.empty:
-                st.dataframe(format_df_for_display(my_logs), use_container_width=True, hide_index=True)
+            render_my_submissions()
+
+        st.markdown("---")
+        render_inventory_table()
 
         st.markdown("---")
+        render_global_log()
 
-        # --- B. 库存明细 (汉化版) ---
-        st.subheader("📊 库存明细表")
+    # ================= 审批中心 =================
+    elif choice == approval_menu_name:
+        st.title("审批中心")
+        render_pending_badge('approval')
 
-        # 获取原始数据
-        original_df = run_query("SELECT * FROM inventory ORDER BY location")
+        with st.expander("📊 申请统计"):
+            counters = fetch_df("SELECT scope, key, status, cnt FROM log_counters WHERE scope != 'all' AND cnt > 0")
+            counters['status'] = counters['status'].map(LOG_STATUS_MAP).fillna(counters['status'])
+            s1, s2 = st.columns(2)
+            for col, scope, title in ((s1, 'type', '操作类型'), (s2, 'applicant', '申请人')):
+                with col:
+                    stats = counters[counters['scope'] == scope].pivot_table(
+                        index='key', columns='status', values='cnt', aggfunc='sum', fill_value=0)
+                    if scope == 'type':
+                        stats.index = stats.index.map(lambda k: LOG_TYPE_MAP.get(k, k))
+                    st.dataframe(stats.rename_axis(title), use_container_width=True)
 
-        if st.session_state.user_role == 'admin':
-            st.info("💡 管理员提示：双击单元格修改，+号新增，选中行删除。操作后请点击【保存表格修改】。")
+        pending = fetch_df("SELECT * FROM logs WHERE status='PENDING' ORDER BY id DESC")
 
-            # 🟢 汉化关键点：使用 column_config 将英文字段映射为中文显示
-            edited_df = st.data_editor(
-                original_df,
-                key="inventory_editor",
+        # 上一次批量操作的逐条结果
+        if 'batch_results' in st.session_state:
+            st.dataframe(pd.DataFrame(st.session_state.pop('batch_results'), columns=['序号', '物品名称', '处理结果']),
+                         use_container_width=True, hide_index=True)
+
+        if not pending.empty:
+            # --- 批量审批 ---
+            st.subheader("📦 批量审批")
+            st.caption("勾选申请后批量批准或拒绝；入库申请需在【分配入库位置】列填写位置，领用申请按申请位置出库。")
+            batch_df = pending[['id', 'action_type', 'applicant', 'name', 'model', 'spec', 'color', 'quantity', 'unit',
+                                'location', 'remark']].copy()
+            batch_df.insert(0, 'selected', False)
+            # 只有入库申请需要分配位置; 领用申请的位置只读, 该列留空
+            batch_df.insert(batch_df.columns.get_loc('location') + 1, 'assign_location',
+                            np.where(batch_df['action_type'] == 'IN', "", None))
+            batch_df['action_type'] = batch_df['action_type'].map(LOG_TYPE_MAP).fillna(batch_df['action_type'])
+            batch_edit = st.data_editor(
+                batch_df,
+                key="batch_editor",
                 column_config={
-                    "id": st.column_config.NumberColumn("序号", disabled=True),
-                    "name": st.column_config.TextColumn("名称"),
+                    "selected": st.column_config.CheckboxColumn("选择"),
+                    "id": st.column_config.NumberColumn("序号"),
+                    "action_type": st.column_config.TextColumn("操作类型"),
+                    "applicant": st.column_config.TextColumn("申请人"),
+                    "name": st.column_config.TextColumn("物品名称"),
                     "model": st.column_config.TextColumn("型号"),
                     "spec": st.column_config.TextColumn("规格"),
                     "color": st.column_config.TextColumn("颜色"),
-                    "unit": st.column_config.TextColumn("单位"),
                     "quantity": st.column_config.NumberColumn("数量"),
-                    "location": st.column_config.TextColumn("位置"),
+                    "unit": st.column_config.TextColumn("单位"),
+                    "location": st.column_config.TextColumn("申请位置"),
+                    "assign_location": st.column_config.TextColumn("分配入库位置"),
                     "remark": st.column_config.TextColumn("备注")
                 },
+                disabled=[c for c in batch_df.columns if c not in ('selected', 'assign_location')],
                 use_container_width=True,
-                num_rows="dynamic"
+                hide_index=True
             )
+            selected_ids = set(batch_edit.loc[batch_edit['selected'], 'id'].astype(int))
+            selected_rows = [r for r in pending.to_dict('records') if r['id'] in selected_ids]
+            names = {r['id']: r['name'] for r in selected_rows}
+            # 领用申请填写了分配位置的视为误操作, 拒绝批量批准而不是静默忽略
+            out_assigned = batch_edit.loc[batch_edit['selected'] & (pending['action_type'] == 'OUT').to_numpy()
+                                          & batch_edit['assign_location'].fillna("").str.strip().ne(""), 'id']
+            if not out_assigned.empty:
+                st.error(f"❌ 领用申请按申请位置出库，不能分配位置 (序号: {', '.join(map(str, out_assigned))})")
 
-            col_save, col_del = st.columns([1, 6])
-            with col_save:
-                if st.button("💾 保存表格修改"):
-                    try:
-                        # 日志与保存逻辑 (保持英文列名进行处理，因为edited_df的数据结构未变)
-                        old_dict = original_df.set_index('id').to_dict('index') if not original_df.empty else {}
-                        old_ids = set(old_dict.keys())
-                        current_ids = set(edited_df['id'].dropna().astype(int))
-
-                        # 删除检测
-                        deleted_ids = old_ids - current_ids
-                        for did in deleted_ids:
-                            row = old_dict[did]
-                            msg = f"删除了物品: {row['name']} (位置: {row['location']}, 数量: {row['quantity']})"
-                            run_query("""INSERT INTO logs 
-                                      (applicant, action_type, name, model, spec, color, unit, quantity, location, remark, status, timestamp) 
-                                      VALUES (?,?,?,?,?,?,?,?,?,?,?,?)""",
-                                      ('admin', 'ADMIN_DEL', row['name'], row['model'], row['spec'], row['color'],
-                                       row['unit'], row['quantity'], row['location'], msg, 'DONE',
-                                       datetime.datetime.now()))
-
-                        # 新增与修改检测
-                        for index, new_row in edited_df.iterrows():
-                            if pd.isna(new_row['id']):
-                                msg = f"新增了物品: {new_row['name']} (位置: {new_row['location']})"
-                                n_name = new_row['name'] if new_row['name'] else "未知"
-                                run_query("""INSERT INTO logs 
-                                          (applicant, action_type, name, model, spec, color, unit, quantity, location, remark, status, timestamp) 
-                                          VALUES (?,?,?,?,?,?,?,?,?,?,?,?)""",
-                                          ('admin', 'ADMIN_ADD', n_name, new_row['model'], new_row['spec'],
-                                           new_row['color'], new_row['unit'], new_row['quantity'], new_row['location'],
-                                           msg, 'DONE', datetime.datetime.now()))
-                            else:
-                                rid = int(new_row['id'])
-                                if rid in old_dict:
-                                    old_row = old_dict[rid]
-                                    changes = []
-                                    if old_row['quantity'] != new_row['quantity']: changes.append(
-                                        f"数量 {old_row['quantity']}->{new_row['quantity']}")
-                                    if old_row['location'] != new_row['location']: changes.append(
-                                        f"位置 {old_row['location']}->{new_row['location']}")
-                                    if old_row['name'] != new_row['name']: changes.append(f"名称变动")
-                                    if old_row['remark'] != new_row['remark']: changes.append(f"备注变动")
-
-                                    if changes:
-                                        change_msg = "管理员修改: " + ", ".join(changes)
-                                        run_query("""INSERT INTO logs 
-                                                  (applicant, action_type, name, model, spec, color, unit, quantity, location, remark, status, timestamp) 
-                                                  VALUES (?,?,?,?,?,?,?,?,?,?,?,?)""",
-                                                  ('admin', 'ADMIN_EDIT', new_row['name'], new_row['model'],
-                                                   new_row['spec'], new_row['color'], new_row['unit'],
-                                                   new_row['quantity'], new_row['location'], change_msg, 'DONE',
-                                                   datetime.datetime.now()))
-
-                        # 保存
-                        df_existing = edited_df.dropna(subset=['id'])
-                        df_new = edited_df[edited_df['id'].isna()].drop(columns=['id'])
-                        conn = sqlite3.connect(DB_FILE)
-                        c = conn.cursor()
-                        c.execute("DELETE FROM inventory")
-                        df_existing.to_sql('inventory', conn, if_exists='append', index=False)
-                        df_new.to_sql('inventory', conn, if_exists='append', index=False)
-                        conn.commit()
-                        conn.close()
-                        st.success("✅ 保存成功！")
-                        st.rerun()
-                    except Exception as e:
-                        st.error(f"保存失败: {e}")
+            b1, b2, b3 = st.columns([1, 1, 6])
+            with b1:
+                if st.button(f"✅ 批量批准 ({len(selected_rows)})", disabled=not selected_rows or not out_assigned.empty):
+                    locations = dict(zip(batch_edit['id'].astype(int), batch_edit['assign_location']))
+                    results = approve_requests(selected_rows, locations)
+                    st.session_state.batch_results = [(i, names[i], msg) for i, (_, msg) in sorted(results.items())]
+                    st.rerun()
+            with b2:
+                if st.button(f"❌ 批量拒绝 ({len(selected_rows)})", disabled=not selected_rows):
+                    results = reject_requests(sorted(selected_ids))
+                    st.session_state.batch_results = [(i, names[i], msg) for i, (_, msg) in sorted(results.items())]
+                    st.rerun()
 
-        else:
-            # 普通用户：直接翻译表头
-            df_display = original_df.rename(columns=INVENTORY_COL_MAP)
-            st.dataframe(df_display, use_container_width=True, hide_index=True)
+            st.markdown("---")
+            for row in pending.to_dict('records'):
+                st.fragment(render_approval_card, key=f"approval_card_{row['id']}")(row)
 
-        st.markdown("---")
+    # ================= 库存分析 =================
+    elif choice == "📈 库存分析":
+        st.title("库存分析")
+        a1, a2 = st.columns(2)
+        with a1:
+            window_days = st.select_slider("统计窗口 (天)", options=[7, 14, 30, 60, 90, 180, 365], value=30)
+        with a2:
+            cover_days = st.number_input("安全库存天数", min_value=1, value=14, step=1)
+        items, trend, by_location, by_applicant = get_stock_analytics(window_days, int(cover_days))
 
-        # --- C. 全局日志管理 ---
-        st.subheader("📝 全局操作日志")
-        all_logs = run_query("SELECT * FROM logs ORDER BY id DESC")
+        low = items[items['low_stock']]
+        m1, m2, m3, m4 = st.columns(4)
+        m1.metric("入库总量", int(trend['in_qty'].sum()))
+        m2.metric("领用总量", int(trend['out_qty'].sum()))
+        m3.metric("动销物品数", int((items['out_qty'] > 0).sum()))
+        m4.metric("低库存预警", len(low))
 
-        if not all_logs.empty:
-            display_logs = format_df_for_display(all_logs)
-            st.dataframe(display_logs, use_container_width=True, hide_index=True)
+        st.subheader("📉 每日出入库趋势")
+        st.line_chart(trend.rename(columns={'in_qty': '入库', 'out_qty': '领用'}))
 
-            col1, col2 = st.columns([1, 4])
-            with col1:
-                st.download_button(
-                    label="📥 导出日志",
-                    data=display_logs.to_csv(index=False).encode('utf-8_sig'),
-                    file_name=f'logs_{datetime.datetime.now().strftime("%Y%m%d")}.csv',
-                    mime='text/csv'
-                )
-            with col2:
-                if st.session_state.user_role == 'admin':
-                    with st.expander("⚠️ 清理日志"):
-                        if st.button("🔴 确认清空"):
-                            run_query("DELETE FROM logs")
-                            st.success("日志已清空")
-                            st.rerun()
-
-    # ================= 审批中心 =================
-    elif choice == approval_menu_name:
-        st.title("审批中心")
-        if pending_count > 0:
-            st.warning(f"🔔 待处理: {pending_count} 条")
+        item_cols = {'name': '名称', 'model': '型号', 'spec': '规格', 'color': '颜色', 'location': '位置', 'unit': '单位',
+                     'quantity': '当前库存', 'in_qty': '入库量', 'out_qty': '领用量', 'daily_out': '日均领用',
+                     'days_of_cover': '可用天数', 'turnover': '周转率', 'reorder_qty': '建议补货'}
+        number_fmt = {"日均领用": st.column_config.NumberColumn(format="%.2f"),
+                      "可用天数": st.column_config.NumberColumn(format="%.1f"),
+                      "周转率": st.column_config.NumberColumn(format="%.2f")}
+        st.subheader(f"⚠️ 低库存预警 (可用天数 < {int(cover_days)})")
+        if low.empty:
+            st.success("✨ 暂无低库存物品")
         else:
-            st.success("✨ 无待办任务")
+            st.dataframe(low[list(item_cols)].rename(columns=item_cols), column_config=number_fmt,
+                         use_container_width=True, hide_index=True)
 
-        pending = run_query("SELECT * FROM logs WHERE status='PENDING' ORDER BY id DESC")
+        with st.expander("📋 全部物品周转"):
+            st.dataframe(items[list(item_cols)].rename(columns=item_cols), column_config=number_fmt,
+                         use_container_width=True, hide_index=True)
 
-        if not pending.empty:
-            for i, row in pending.iterrows():
-                with st.container(border=True):
-                    cols = st.columns([4, 2, 1])
-                    with cols[0]:
-                        type_str = "🟢 申请入库" if row['action_type'] == 'IN' else "🔴 申请领用"
-                        st.markdown(f"**{type_str}** | 申请人: {row['applicant']}")
-                        st.write(f"物品: **{row['name']}** | 数量: **{row['quantity']} {row['unit']}**")
-                        st.text(f"详情: {row['model']} | {row['spec']} | {row['color']}")
-                        if row['action_type'] == 'OUT': st.text(f"领用位置: {row['location']}")
-                        st.text(f"备注: {row['remark']}")
-
-                    with cols[1]:
-                        final_location = row['location']
-                        if row['action_type'] == 'IN':
-                            final_location = st.text_input(f"📍 分配入库位置 (必填)", key=f"loc_{row['id']}")
-
-                        if st.button("批准", key=f"ok_{row['id']}"):
-                            if final_location: final_location = final_location.strip().lower()
-                            if not final_location:
-                                st.error("❌ 必须分配一个位置")
-                            else:
-                                if row['action_type'] == 'IN':
-                                    check_sql = "SELECT id, quantity FROM inventory WHERE name=? AND model=? AND spec=? AND location=? AND color=?"
-                                    existing = run_query(check_sql,
-                                                         (row['name'], row['model'], row['spec'], final_location,
-                                                          row['color']))
-                                    if not existing.empty:
-                                        new_qty = existing.iloc[0]['quantity'] + row['quantity']
-                                        run_query("UPDATE inventory SET quantity=?, remark=? WHERE id=?",
-                                                  (int(new_qty), row['remark'], int(existing.iloc[0]['id'])))
-                                    else:
-                                        run_query(
-                                            "INSERT INTO inventory (name, model, spec, color, unit, quantity, location, remark) VALUES (?,?,?,?,?,?,?,?)",
-                                            (row['name'], row['model'], row['spec'], row['color'], row['unit'],
-                                             row['quantity'], final_location, row['remark']))
-                                else:
-                                    check_sql = "SELECT id, quantity FROM inventory WHERE name=? AND model=? AND spec=? AND location=? AND color=?"
-                                    existing = run_query(check_sql,
-                                                         (row['name'], row['model'], row['spec'], final_location,
-                                                          row['color']))
-                                    if existing.empty or existing.iloc[0]['quantity'] < row['quantity']:
-                                        st.error(f"库存不足！")
-                                        continue
-                                    else:
-                                        new_qty = existing.iloc[0]['quantity'] - row['quantity']
-                                        if new_qty == 0:
-                                            run_query("DELETE FROM inventory WHERE id=?",
-                                                      (int(existing.iloc[0]['id']),))
-                                        else:
-                                            run_query("UPDATE inventory SET quantity=? WHERE id=?",
-                                                      (int(new_qty), int(existing.iloc[0]['id'])))
-                                run_query("UPDATE logs SET status='APPROVED', location=? WHERE id=?",
-                                          (final_location, row['id']))
-                                st.success("已批准")
-                                st.rerun()
-
-                    with cols[2]:
-                        st.write("")
-                        if st.button("拒绝", key=f"no_{row['id']}"):
-                            run_query("UPDATE logs SET status='REJECTED' WHERE id=?", (row['id'],))
-                            st.error("已拒绝")
-                            st.rerun()
+        totals_cols = {'in_qty': '入库量', 'out_qty': '领用量', 'moves': '笔数'}
+        s1, s2 = st.columns(2)
+        with s1:
+            st.markdown("##### 按位置")
+            st.dataframe(by_location.rename(columns=totals_cols).rename_axis('位置'), use_container_width=True)
+        with s2:
+            st.markdown("##### 按申请人")
+            st.dataframe(by_applicant.rename(columns=totals_cols).rename_axis('申请人'), use_container_width=True)
+
+        st.markdown("---")
+        st.subheader("🕰️ 历史库存")
+        today = datetime.date.today()
+        h1, h2 = st.columns(2)
+        with h1:
+            start_day = st.date_input("起始日期", value=today - datetime.timedelta(days=30), max_value=today)
+        with h2:
+            end_day = st.date_input("截止日期", value=today, max_value=today)
+        # 按所选日期当天结束时的库存计算
+        start_at, end_at = (datetime.datetime.combine(d, datetime.time.max) for d in (start_day, end_day))
+        stock_cols = {'name': '名称', 'model': '型号', 'spec': '规格', 'color': '颜色', 'location': '位置', 'unit': '单位',
+                      'quantity': '数量', 'quantity_start': f'{start_day} 数量', 'quantity_end': f'{end_day} 数量',
+                      'change': '变化'}
+        tab_diff, tab_snapshot = st.tabs(["📊 两日对比", f"📦 {end_day} 库存"])
+        with tab_diff:
+            changes = diff_stock(start_at, end_at)
+            st.caption(f"共 {len(changes)} 个物品数量有变化")
+            st.dataframe(changes.rename(columns=stock_cols), use_container_width=True, hide_index=True)
+        with tab_snapshot:
+            st.dataframe(stock_as_of(end_at).rename(columns=stock_cols), use_container_width=True, hide_index=True)
+
+        with st.expander("🗂️ 库存检查点"):
+            st.caption(f"管理员使用系统时每 {CHECKPOINT_INTERVAL.days} 天自动保存一次完整库存；{CHECKPOINT_KEEP_DAYS} 天前的检查点每月只保留一个。")
+            if st.button("📌 立即创建检查点"):
+                create_stock_checkpoint(force=True)
+                st.success("✅ 已创建检查点")
+            st.dataframe(fetch_df("""SELECT id AS 序号, taken_at AS 创建时间, items AS 物品数, last_log_id AS 日志位置
+                                     FROM stock_checkpoints ORDER BY id DESC"""),
+                         use_container_width=True, hide_index=True)
+
+    if st.session_state.user_role == 'admin':
+        render_query_profile()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,193 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import sqlite3
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import app
+
+# --- 仓管系统性能基准: 无界面运行, 生成合成数据并统计各核心操作的 p50/p99 延迟与峰值内存 ---
+# 用法: python bench.py --skus 100000 --logs 10000000 --output bench_results.json [--compare old.json]
+
+STATUSES = np.array(['APPROVED', 'DONE', 'REJECTED', 'PENDING'])
+STATUS_P = [0.6, 0.25, 0.1, 0.05]
+ACTIONS = np.array(['IN', 'OUT', 'ADMIN_EDIT', 'ADMIN_ADD', 'ADMIN_DEL'])
+ACTION_P = [0.45, 0.45, 0.06, 0.02, 0.02]
+
+
+def seed(n_skus, n_logs, days=730, chunk=200_000, rng_seed=0):
+    rng = np.random.default_rng(rng_seed)
+    app.init_db()
+    with app.db_transaction() as conn:
+        # 批量灌数时先移除汇总触发器, 完成后由 init_db 重建并一次性回填
+        for trigger in ('trg_logs_count_insert', 'trg_logs_count_delete', 'trg_logs_count_status',
+                        'trg_logs_daily_insert', 'trg_logs_daily_approve'):
+            conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        conn.execute("DROP TABLE IF EXISTS log_counters")
+        conn.execute("DROP TABLE IF EXISTS stock_daily")
+
+    with app.db_transaction() as conn:
+        for start in range(0, n_skus, chunk):
+            ids = np.arange(start, min(start + chunk, n_skus))
+            conn.executemany(
+                """INSERT INTO inventory (name, model, spec, color, unit, quantity, location, remark)
+                   VALUES (?,?,?,?,?,?,?,?)""",
+                ((f"item{i}", f"m{i % 97}", f"s{i % 13}", f"c{i % 7}", "pcs", int(q), f"loc{i % 500}", "")
+                 for i, q in zip(ids.tolist(), rng.integers(1, 1000, len(ids)).tolist())))
+
+    t0 = datetime.datetime.now() - datetime.timedelta(days=days)
+    for start in range(0, n_logs, chunk):
+        n = min(chunk, n_logs - start)
+        skus = rng.integers(0, max(n_skus, 1), n).tolist()
+        offsets = np.sort(rng.integers(0, days * 86400, n)).tolist()
+        statuses = rng.choice(STATUSES, n, p=STATUS_P).tolist()
+        actions = rng.choice(ACTIONS, n, p=ACTION_P).tolist()
+        applicants = [f"user{u}" for u in rng.integers(0, 50, n).tolist()]
+        with app.db_transaction() as conn:
+            conn.executemany(app.LOG_INSERT_SQL, (
+                (applicants[k], actions[k], f"item{i}", f"m{i % 97}", f"s{i % 13}", f"c{i % 7}", "pcs",
+                 1 + i % 10, f"loc{i % 500}", "", statuses[k], t0 + datetime.timedelta(seconds=offsets[k]))
+                for k, i in enumerate(skus)))
+    app.init_db()
+    app.create_stock_checkpoint(force=True)
+    app.run_query("ANALYZE")
+
+
+def measure(fn, repeat):
+    timings = []
+    tracemalloc.start()
+    peak = 0
+    for _ in range(repeat):
+        tracemalloc.reset_peak()
+        t = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - t) * 1000)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+    tracemalloc.stop()
+    return {
+        'p50_ms': float(np.percentile(timings, 50)),
+        'p99_ms': float(np.percentile(timings, 99)),
+        'mean_ms': float(np.mean(timings)),
+        'peak_mem_mb': peak / 1024 / 1024,
+        'repeat': repeat,
+    }
+
+
+def build_cases(n_skus, rng):
+    now = datetime.datetime.now()
+
+    def sku():
+        i = int(rng.integers(0, max(n_skus, 1)))
+        return f"item{i}", f"m{i % 97}", f"s{i % 13}", f"c{i % 7}", f"loc{i % 500}"
+
+    def admin_in():
+        name, model, spec, color, location = sku()
+        app.admin_stock_move('IN', 'admin', name, model, spec, color, "pcs", 1, location, "")
+
+    def admin_out():
+        name, model, spec, color, location = sku()
+        app.admin_stock_move('OUT', 'admin', name, model, spec, color, "pcs", 1, location, "")
+
+    def approval():
+        name, model, spec, color, location = sku()
+        with app.db_transaction() as conn:
+            log_id = conn.execute(app.LOG_INSERT_SQL, ('bench', 'IN', name, model, spec, color, "pcs", 1, "", "",
+                                                       'PENDING', now)).lastrowid
+        request = app.fetch_one("SELECT * FROM logs WHERE id=?", (log_id,), records=True)
+        app.approve_requests([request], {log_id: location})
+
+    ids = app.fetch_df("SELECT id FROM inventory")['id'].to_numpy()
+
+    def editor_save():
+        # 每次读取目标行的当前版本, 测量的是正常保存路径而不是版本冲突路径
+        row = app.fetch_df("SELECT * FROM inventory WHERE id=?", (int(rng.choice(ids)),))
+        app.save_inventory_edits(row, {'edited_rows': {0: {'remark': f"bench {time.time()}"}}})
+
+    newest = app.fetch_scalar("SELECT MAX(id) FROM logs", default=0)
+    recent = (datetime.date.today() - datetime.timedelta(days=7), datetime.date.today())
+    filtered = app.build_log_filter(recent, "user1", ("OUT",), ("APPROVED",))
+
+    return {
+        'pending_badge': lambda: app.fetch_scalar(
+            "SELECT cnt FROM log_counters WHERE scope='all' AND key='' AND status='PENDING'", default=0),
+        'inventory_read': lambda: app.fetch_df("SELECT * FROM inventory ORDER BY location"),
+        'admin_in': admin_in,
+        'admin_out': admin_out,
+        'approval': approval,
+        'editor_save': editor_save,
+        'log_page_first': lambda: app.fetch_log_page(app.build_log_filter(), None, 50),
+        'log_page_deep': lambda: app.fetch_log_page(app.build_log_filter(), int(newest * 0.1), 50),
+        'log_page_filtered': lambda: app.fetch_log_page(filtered, None, 50),
+        'export_csv_7d': lambda: app.export_logs(app.build_log_filter(recent)).close(),
+        # 绕过 st.cache_data, 测量未命中缓存时的计算耗时
+        'stock_as_of_now': lambda: app.stock_as_of(datetime.datetime.now()),
+        'analytics_30d': lambda: app.load_stock_analytics.__wrapped__(-1, datetime.date.today(), 30, 14),
+    }
+
+
+def compare(results, baseline_file):
+    with open(baseline_file, encoding='utf-8') as f:
+        baseline = json.load(f)['results']
+    print(f"\n{'operation':<20}{'base p50':>12}{'p50':>12}{'ratio':>8}")
+    for op, r in results.items():
+        if op in baseline:
+            base = baseline[op]['p50_ms']
+            print(f"{op:<20}{base:>12.2f}{r['p50_ms']:>12.2f}{r['p50_ms'] / base if base else float('nan'):>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="仓管系统性能基准")
+    parser.add_argument('--db', default='bench_warehouse.db', help="基准数据库路径 (不要指向生产库)")
+    parser.add_argument('--skus', type=int, default=10_000)
+    parser.add_argument('--logs', type=int, default=200_000)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--reuse', action='store_true', help="复用已有的基准数据库, 不重新生成数据")
+    parser.add_argument('--only', nargs='*', help="只运行指定的操作")
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help="与之前保存的结果对比")
+    args = parser.parse_args()
+
+    if os.path.abspath(args.db) == os.path.abspath(app.DB_FILE):
+        sys.exit("基准测试不能使用生产数据库")
+    app.DB_FILE = args.db
+    if not args.reuse:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+        t = time.perf_counter()
+        seed(args.skus, args.logs)
+        print(f"seeded {args.skus} skus / {args.logs} logs in {time.perf_counter() - t:.1f}s")
+
+    rng = np.random.default_rng(1)
+    results = {}
+    for op, fn in build_cases(args.skus, rng).items():
+        if args.only and op not in args.only:
+            continue
+        repeat = max(args.repeat // 10, 3) if op.startswith('export') else args.repeat
+        results[op] = measure(fn, repeat)
+        r = results[op]
+        print(f"{op:<20} p50 {r['p50_ms']:>10.2f} ms   p99 {r['p99_ms']:>10.2f} ms   peak {r['peak_mem_mb']:>8.2f} MB")
+
+    report = {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'skus': args.skus,
+        'logs': app.fetch_scalar("SELECT COUNT(*) FROM logs"),
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"results saved to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file